@@ -1,9 +1,11 @@
 CREATE TABLE IF NOT EXISTS jobs (
     uuid UUID PRIMARY KEY,
-    state TEXT CHECK(state IN ('PENDING', 'COMPLETED', 'FAILED')),
+    state TEXT CHECK(state IN ('PENDING', 'COMPLETED', 'FAILED', 'CANCELLED')),
     type TEXT CHECK(type IN ('VIDEO_COMPRESSION_JOB')),
     createdAt TIMESTAMP NOT NULL,
-    expiresAt TIMESTAMP
+    expiresAt TIMESTAMP,
+    owner TEXT,
+    attempts INT NOT NULL DEFAULT 0
 );
 
 CREATE TABLE IF NOT EXISTS VideoCompressionJob (
@@ -13,19 +15,64 @@ CREATE TABLE IF NOT EXISTS VideoCompressionJob (
     quality TEXT NOT NULL,
     factor INT NOT NULL,
     framerate INT NOT NULL,
+    artifacts TEXT NOT NULL DEFAULT '',
+    targetMetric TEXT CHECK(targetMetric IN ('ssim', 'psnr')),
+    targetValue REAL,
+    measuredQuality REAL,
+    codec TEXT NOT NULL DEFAULT 'libx264',
+    presetFastest TEXT,
+    presetSlowest TEXT,
+    preset TEXT,
+    chunked BOOLEAN NOT NULL DEFAULT 0,
     FOREIGN KEY (job) REFERENCES jobs(id)
 );
 
+CREATE TABLE IF NOT EXISTS VideoChunk (
+    job UUID NOT NULL,
+    idx INT NOT NULL,
+    startTime REAL NOT NULL,
+    endTime REAL NOT NULL,
+    completed BOOLEAN NOT NULL DEFAULT 0,
+    PRIMARY KEY (job, idx),
+    FOREIGN KEY (job) REFERENCES VideoCompressionJob(job)
+);
+
 CREATE TABLE IF NOT EXISTS VideoCompressionStatistics (
     vcj UUID,
     originalSizeBytes INT NOT NULL,
     finalSizeBytes INT NOT NULL,
     startTimestamp INT NOT NULL,
     endTimestamp INT NOT NULL,
+    crf INT,
+    qualityMetric TEXT,
+    qualityScore REAL,
+    codec TEXT,
+    preset TEXT,
     FOREIGN KEY (vcj) REFERENCES VideoCompressionJob(job)
 );
 
+CREATE TABLE IF NOT EXISTS VideoArtifact (
+    job UUID NOT NULL,
+    kind TEXT CHECK(kind IN ('poster', 'sprite', 'preview')),
+    path TEXT NOT NULL,
+    FOREIGN KEY (job) REFERENCES VideoCompressionJob(job)
+);
+
 CREATE TABLE IF NOT EXISTS Client (
     apikey UUID NOT NULL,
     revoked BOOLEAN NOT NULL
-);
\ No newline at end of file
+);
+
+CREATE INDEX IF NOT EXISTS idx_jobs_state_created ON jobs (state, createdAt, uuid);
+
+CREATE INDEX IF NOT EXISTS idx_jobs_created ON jobs (createdAt, uuid);
+
+CREATE INDEX IF NOT EXISTS idx_jobs_owner_created ON jobs (owner, createdAt, uuid);
+
+CREATE INDEX IF NOT EXISTS idx_jobs_type_created ON jobs (type, createdAt, uuid);
+
+CREATE INDEX IF NOT EXISTS idx_vcj_job ON VideoCompressionJob (job);
+
+CREATE INDEX IF NOT EXISTS idx_artifact_job ON VideoArtifact (job);
+
+CREATE INDEX IF NOT EXISTS idx_artifact_path ON VideoArtifact (path);
@@ -0,0 +1,153 @@
+import math
+import os
+import threading
+import time
+from dataclasses import dataclass
+
+# Per API key
+REQUESTS_PER_SECOND = float(os.environ.get("ADMISSION_REQUESTS_PER_SECOND", "5"))
+REQUESTS_BURST = float(os.environ.get("ADMISSION_REQUESTS_BURST", "20"))
+UPLOAD_BYTES_PER_SECOND = float(os.environ.get("ADMISSION_UPLOAD_BYTES_PER_SECOND", str(50 * 1024 * 1024)))
+UPLOAD_BYTES_BURST = float(os.environ.get("ADMISSION_UPLOAD_BYTES_BURST", str(4 * 1024 * 1024 * 1024)))
+ENCODE_SECONDS_IN_FLIGHT = float(os.environ.get("ADMISSION_ENCODE_SECONDS_IN_FLIGHT", str(12 * 60 * 60)))
+
+# Whole service
+MAX_QUEUE_DEPTH = int(os.environ.get("ADMISSION_MAX_QUEUE_DEPTH", "10000"))
+MAX_DRAIN_SECONDS = float(os.environ.get("ADMISSION_MAX_DRAIN_SECONDS", str(24 * 60 * 60)))
+MIN_FREE_BYTES = int(os.environ.get("ADMISSION_MIN_FREE_BYTES", str(2 * 1024 * 1024 * 1024)))
+DISK_RETRY_AFTER = float(os.environ.get("ADMISSION_DISK_RETRY_AFTER", "600"))
+
+
+@dataclass
+class Rejection:
+    status: int
+    retryAfter: float
+    reason: str
+
+    def retryAfterHeader(self):
+        return str(max(1, math.ceil(self.retryAfter)))
+
+
+class TokenBucket:
+    __slots__ = ("rate", "capacity", "tokens", "updatedAt")
+
+    def __init__(self, rate: float, capacity: float, now: float | None = None):
+        self.rate = rate
+        self.capacity = capacity
+        self.tokens = capacity
+        self.updatedAt = time.monotonic() if now is None else now
+
+    def take(self, amount: float, now: float | None = None) -> float:
+        """
+        Takes amount tokens and returns 0, or returns the seconds until
+        enough tokens will be available and takes nothing.
+        """
+        now = time.monotonic() if now is None else now
+        self.tokens = min(self.capacity, self.tokens + (now - self.updatedAt) * self.rate)
+        self.updatedAt = now
+
+        if amount > self.capacity:
+            return math.inf
+
+        if self.tokens >= amount:
+            self.tokens -= amount
+            return 0
+
+        return (amount - self.tokens) / self.rate
+
+
+class ClientLimits:
+    __slots__ = ("requests", "uploadBytes", "encodeSecondsInFlight")
+
+    def __init__(self, now: float | None = None):
+        self.requests = TokenBucket(REQUESTS_PER_SECOND, REQUESTS_BURST, now)
+        self.uploadBytes = TokenBucket(UPLOAD_BYTES_PER_SECOND, UPLOAD_BYTES_BURST, now)
+        self.encodeSecondsInFlight = 0.0
+
+
+class AdmissionController:
+    # Limiter state lives in memory only, every check is a dict lookup and
+    # some arithmetic under one lock.
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.clients: dict[str, ClientLimits] = {}
+        self.jobs: dict[str, tuple[str, float]] = {}
+
+    def _client(self, apikey: str) -> ClientLimits:
+        client = self.clients.get(apikey)
+        if client is None:
+            client = ClientLimits()
+            self.clients[apikey] = client
+
+        return client
+
+    def admitRequest(self, apikey: str) -> Rejection | None:
+        with self.lock:
+            wait = self._client(apikey).requests.take(1)
+
+        if wait > 0:
+            return Rejection(429, wait, "Too many requests for this API key")
+
+        return None
+
+    def admitUpload(self, apikey: str, sizeBytes: int) -> Rejection | None:
+        with self.lock:
+            wait = self._client(apikey).uploadBytes.take(sizeBytes)
+
+        if wait == math.inf:
+            return Rejection(413, 0, f"Upload larger than the {int(UPLOAD_BYTES_BURST)} bytes allowed")
+
+        if wait > 0:
+            return Rejection(429, wait, "Upload byte rate exceeded for this API key")
+
+        return None
+
+    def reserveEncode(self, apikey: str, jobId: str, encodeSeconds: float) -> Rejection | None:
+        with self.lock:
+            client = self._client(apikey)
+            over = client.encodeSecondsInFlight + encodeSeconds - ENCODE_SECONDS_IN_FLIGHT
+
+            # A single job larger than the whole budget is let through when
+            # nothing else is in flight, otherwise it could never run.
+            if over > 0 and client.encodeSecondsInFlight > 0:
+                return Rejection(429, over, "Too many encode seconds in flight for this API key")
+
+            client.encodeSecondsInFlight += encodeSeconds
+            self.jobs[jobId] = (apikey, encodeSeconds)
+
+        return None
+
+    def releaseEncode(self, jobId: str):
+        with self.lock:
+            reservation = self.jobs.pop(jobId, None)
+            if reservation is None:
+                return
+
+            apikey, encodeSeconds = reservation
+            client = self.clients.get(apikey)
+            if client is not None:
+                client.encodeSecondsInFlight = max(0.0, client.encodeSecondsInFlight - encodeSeconds)
+
+
+def checkBackpressure(queueDepth: int, drainSeconds: float, freeBytes: int) -> Rejection | None:
+    if freeBytes < MIN_FREE_BYTES:
+        return Rejection(503, DISK_RETRY_AFTER, "Not enough free disk space")
+
+    if queueDepth >= MAX_QUEUE_DEPTH:
+        perJob = drainSeconds / queueDepth if queueDepth > 0 else 0
+        return Rejection(503, (queueDepth - MAX_QUEUE_DEPTH + 1) * perJob, "Job queue is full")
+
+    if drainSeconds > MAX_DRAIN_SECONDS:
+        return Rejection(503, drainSeconds - MAX_DRAIN_SECONDS, "Job queue would take too long to drain")
+
+    return None
+
+
+_instance = None
+
+def getAdmissionController() -> AdmissionController:
+    global _instance
+    if _instance is None:
+        _instance = AdmissionController()
+
+    return _instance
@@ -1,4 +1,4 @@
-from flask import Flask, request, jsonify
+from flask import Flask, Response, request, jsonify, send_file
 import sqlite3
 import uuid
 import os
@@ -12,6 +12,16 @@ from werkzeug.utils import secure_filename
 import extensions
 import job_statistics
 import auth
+import job_query
+import fastjson
+import transfer
+import admission
+import shutil
+import crf_search
+import codec_profiles
+import scratch
+from datetime import datetime
+from urllib.parse import urlencode
 
 app = Flask(__name__, static_url_path='/api_data', static_folder="/api_data")
 
@@ -19,6 +29,19 @@ app.config['UPLOAD_FOLDER'] = '/api_data'
 
 FILES_FOLDER = os.path.join(app.config['UPLOAD_FOLDER'], "files")
 
+def rejectionResponse(rejection: admission.Rejection):
+    response = jsonify({'error': rejection.reason})
+    response.status_code = rejection.status
+    if rejection.status in [429, 503]:
+        response.headers['Retry-After'] = rejection.retryAfterHeader()
+    return response
+
+def checkBackpressure():
+    jobManager = job.getJobManager()
+
+    return admission.checkBackpressure(jobManager.pendingCount, jobManager.estimateDrainSeconds(), shutil.disk_usage(FILES_FOLDER).free)
+
+
 @app.route('/ping', methods=['GET'])
 def ping():
     logging.info("hello world this is a logging test")
@@ -29,6 +52,19 @@ def ping():
 def statistics():
     return jsonify(job_statistics.generateVideoCompressionStatisticsDict()), 200
 
+@app.route('/codecs', methods=['GET'])
+def codecs():
+    model = job_statistics.getCostModel()
+
+    return jsonify([{
+        'codec': profile.name,
+        'container': profile.container,
+        'minFactor': profile.minCrf,
+        'maxFactor': profile.maxCrf,
+        'defaultPreset': profile.defaultPreset,
+        'presets': [{'name': preset, 'speed': model.cost(profile.name, preset).speed, 'size': model.cost(profile.name, preset).size} for preset in profile.presets]
+    } for profile in codec_profiles.PROFILES.values()]), 200
+
 @app.route('/issue-key', methods=['POST'])
 def issueKey():
     json = request.json
@@ -47,6 +83,20 @@ def issueKey():
 @app.route('/upload-file', methods=['POST'])
 @auth.requireApiKey
 def uploadFile():
+    apikey = request.headers.get('X-API-Key')
+    controller = admission.getAdmissionController()
+
+    # Without a length the upload can't be charged to the byte bucket
+    if request.content_length is None:
+        return jsonify({'error': 'Content-Length header required'}), 411
+
+    rejection = controller.admitRequest(apikey) or checkBackpressure()
+    if rejection is None:
+        rejection = controller.admitUpload(apikey, request.content_length)
+
+    if rejection is not None:
+        return rejectionResponse(rejection)
+
     if 'file' not in request.files:
         return jsonify({'error': 'No file part'}), 400 
     
@@ -78,27 +128,156 @@ def getJob():
     return jsonify(obj.toDict()), 200
 
 
+@app.route('/job/artifacts', methods=['GET'])
+@auth.requireApiKey
+def getJobArtifacts():
+    jobId = request.args.get('id')
+    obj = job.getJobManager().getJobById(jobId)
+
+    if obj is None:
+        return jsonify({'error': 'Not found'}), 404
+
+    artifacts = {}
+    for kind, paths in obj.getArtifacts().items():
+        artifacts[kind] = [{
+            'file_path': path,
+            'file_name': os.path.basename(path),
+            'url': f"{app.static_url_path}/{os.path.relpath(path, app.config['UPLOAD_FOLDER'])}"
+        } for path in paths]
+
+    return jsonify({'uuid': obj.baseData.uuid, 'state': obj.baseData.state.name, 'artifacts': artifacts}), 200
+
+
+@app.route('/job', methods=['DELETE'])
+@auth.requireApiKey
+def cancelJob():
+    jobId = request.args.get('id')
+    jobManager = job.getJobManager()
+    obj = jobManager.getJobById(jobId)
+
+    if obj is None:
+        return jsonify({'error': 'Not found'}), 404
+
+    if obj.baseData.owner is not None and obj.baseData.owner != request.headers.get('X-API-Key'):
+        return jsonify({'error': 'Job belongs to another client'}), 403
+
+    obj = jobManager.cancelJob(jobId)
+    # A running job is finalized on another thread, the answer must not
+    # mix states from before and after
+    values = obj.toDict()
+
+    if values['state'] in [job.JobState.COMPLETED.name, job.JobState.FAILED.name]:
+        return jsonify({'error': f'Job already finished with state {values["state"]}'}), 409
+
+    # A running job only turns CANCELLED once its encode was killed
+    if values['state'] == job.JobState.PENDING.name:
+        return jsonify(values), 202
+
+    return jsonify(values), 200
+
+
 @app.route('/active-jobs', methods=['GET'])
 @auth.requireApiKey
 def getJobs():
     jobManager = job.getJobManager()
     return jsonify(jobManager.getActiveJobList()), 200
 
+@app.route('/jobs', methods=['GET'])
+@auth.requireApiKey
+def listJobs():
+    jobManager = job.getJobManager()
+    query = urlencode(sorted(request.args.items(multi=True)))
+    etag = jobManager.getEtag(query, request.headers.get('X-API-Key'))
+
+    if request.if_none_match.contains(etag):
+        response = Response(status=304)
+        response.set_etag(etag)
+        return response
+
+    filter = job_query.JobListFilter()
+
+    try:
+        state = request.args.get('state')
+        if state is not None:
+            filter.state = job.JobState[state]
+    except KeyError:
+        return jsonify({'error': f'Invalid state. Must be one of {[s.name for s in job.JobState]}'}), 400
+
+    try:
+        type = request.args.get('type')
+        if type is not None:
+            filter.type = job.JobType[type]
+    except KeyError:
+        return jsonify({'error': f'Invalid type. Must be one of {[t.name for t in job.JobType]}'}), 400
+
+    owner = request.args.get('owner')
+    if owner is not None:
+        if owner != 'me':
+            return jsonify({'error': 'Invalid owner. Must be "me"'}), 400
+        filter.owner = request.headers.get('X-API-Key')
+
+    try:
+        createdAfter = request.args.get('createdAfter')
+        createdBefore = request.args.get('createdBefore')
+        filter.createdAfter = datetime.fromisoformat(createdAfter) if createdAfter else None
+        filter.createdBefore = datetime.fromisoformat(createdBefore) if createdBefore else None
+    except ValueError:
+        return jsonify({'error': 'Invalid time range. Expected ISO 8601 timestamps'}), 400
+
+    try:
+        limit = int(request.args.get('limit', job_query.DEFAULT_PAGE_SIZE))
+        if limit < 1 or limit > job_query.MAX_PAGE_SIZE:
+            raise ValueError
+    except ValueError:
+        return jsonify({'error': f'Invalid limit. Must be between 1 and {job_query.MAX_PAGE_SIZE}'}), 400
+
+    fields = request.args.get('fields')
+    if fields is not None:
+        fields = fields.split(',')
+        if not all(field in job_query.JOB_FIELDS for field in fields):
+            return jsonify({'error': f'Invalid fields. Must be a subset of {job_query.JOB_FIELDS}'}), 400
+
+    try:
+        page = job_query.listJobs(filter, request.args.get('cursor'), limit)
+    except ValueError:
+        return jsonify({'error': 'Invalid cursor'}), 400
+
+    body = fastjson.dumps({
+        'jobs': [job_query.selectFields(obj.toDict(), fields) for obj in page.jobs],
+        'nextCursor': page.nextCursor
+    })
+
+    response = Response(body, status=200, mimetype='application/json', headers={'Cache-Control': 'no-cache'})
+    response.set_etag(etag)
+    return response
+
 @app.route('/schedule-video-compression', methods=['POST'])
 @auth.requireApiKey
 def scheduleVideoCompression():
+    apikey = request.headers.get('X-API-Key')
+    controller = admission.getAdmissionController()
+
+    rejection = controller.admitRequest(apikey) or checkBackpressure()
+    if rejection is not None:
+        return rejectionResponse(rejection)
 
     data = request.json
 
     filename = data["filename"]
     quality = data["quality"]
     framerate = data["framerate"]
-    factor = data["factor"]
+    targetQuality = data.get("targetQuality")
+    # With a quality target, factor is optional and bounds the CRF search from below
+    factor = data.get("factor", crf_search.DEFAULT_MIN_CRF if targetQuality is not None else None)
+    artifacts = data.get("artifacts", [])
+    codec = data.get("codec", codec_profiles.DEFAULT_CODEC)
+    preset = data.get("preset")
+    presetRange = data.get("presetRange")
 
     ext = extensions.extractExtension(filename)
 
-    if ext != 'mp4':
-        return jsonify({'error': 'File format should be mp4'}), 400
+    if extensions.extensionToMediaType(ext) is None:
+        return jsonify({'error': f'File format should be one of {list(extensions.MEDIA_TYPES.values())}'}), 400
 
     if not os.path.exists(os.path.join(FILES_FOLDER, filename)):
         return jsonify({'error': 'File not found'}), 400
@@ -106,8 +285,12 @@ def scheduleVideoCompression():
     if not all([filename, quality, framerate, factor]):
         return jsonify({'error': 'Missing required parameters'}), 400
     
-    if quality not in ['720p', '1080p']:
-        return jsonify({'error': 'Invalid quality. Must be 720p or 1080p'}), 400
+    if quality not in ffmpeg.QUALITY_HEIGHTS:
+        return jsonify({'error': f'Invalid quality. Must be one of {list(ffmpeg.QUALITY_HEIGHTS)}'}), 400
+
+    profile = codec_profiles.getProfile(codec)
+    if profile is None:
+        return jsonify({'error': f'Invalid codec. Must be one of {list(codec_profiles.PROFILES)}'}), 400
 
     try:
         framerate = int(framerate)
@@ -118,27 +301,196 @@ def scheduleVideoCompression():
 
     try:
         factor = int(factor)
-        if factor < 10 or factor > 50:
+        if factor < profile.minCrf or factor > profile.maxCrf:
             raise ValueError
     except ValueError:
-        return jsonify({'error': 'Invalid factor. Must be between 10 and 50'}), 400
+        return jsonify({'error': f'Invalid factor. Must be between {profile.minCrf} and {profile.maxCrf} for {profile.name}'}), 400
+
+    # A fixed preset is a range of one, without either the codec default is used
+    if preset is not None and presetRange is not None:
+        return jsonify({'error': 'Expected either preset or presetRange, not both'}), 400
+
+    try:
+        if preset is not None:
+            presetRange = {"fastest": preset, "slowest": preset}
+        if presetRange is not None:
+            presetRange = (str(presetRange["fastest"]), str(presetRange["slowest"]))
+            profile.presetRange(*presetRange)
+    except (KeyError, TypeError, ValueError):
+        return jsonify({'error': f'Invalid preset. {profile.name} presets from fastest to slowest are {profile.presets}'}), 400
+
+    target = None
+    if targetQuality is not None:
+        try:
+            target = crf_search.QualityTarget(targetQuality["metric"], float(targetQuality["value"]))
+            if target.metric not in crf_search.QUALITY_METRICS:
+                raise ValueError
+            if target.metric == "ssim" and not 0 < target.value <= 1:
+                raise ValueError
+            if target.metric == "psnr" and not 0 < target.value <= 100:
+                raise ValueError
+        except (KeyError, TypeError, ValueError):
+            return jsonify({'error': 'Invalid targetQuality. Expected {"metric": "ssim", "value": 0-1} or {"metric": "psnr", "value": 0-100}'}), 400
+
+    if not isinstance(artifacts, list) or not all(kind in ffmpeg.ARTIFACT_KINDS for kind in artifacts):
+        return jsonify({'error': f'Invalid artifacts. Must be a subset of {ffmpeg.ARTIFACT_KINDS}'}), 400
 
     newJob = job.VideoCompressionJob(
         job.VideoCompressorJobData(
-            job.BaseJobData(str(uuid.uuid4()), job.JobState.PENDING, job.JobType.VIDEO_COMPRESSION_JOB, job.datetime.now(), None),
+            job.BaseJobData(str(uuid.uuid4()), job.JobState.PENDING, job.JobType.VIDEO_COMPRESSION_JOB, job.datetime.now(), None, apikey),
             os.path.join(FILES_FOLDER, filename),
-            os.path.join(FILES_FOLDER, extensions.generateFileNameByMedia("video/mp4")),
+            os.path.join(FILES_FOLDER, extensions.generateFileNameByMedia(extensions.extensionToMediaType(profile.container))),
             quality,
             factor,
-            framerate
+            framerate,
+            list(dict.fromkeys(artifacts)),
+            target,
+            codec=profile.name,
+            presetRange=presetRange
         )
     )
 
+    encodeSeconds = job_statistics.estimateEncodeSeconds(os.path.getsize(newJob.originalFilePath))
+    rejection = controller.reserveEncode(apikey, newJob.baseData.uuid, encodeSeconds)
+    if rejection is not None:
+        return rejectionResponse(rejection)
+
     job.getJobManager().pushJob(newJob)
 
     return jsonify(newJob.toDict()), 200
 
 
+def leaseToDict(lease: job.Lease):
+    return {
+        'leaseId': lease.leaseId,
+        'leaseSeconds': job.LEASE_SECONDS,
+        'job': lease.job.toDict()
+    }
+
+def sourceMediaType(path: str):
+    return extensions.extensionToMediaType(extensions.extractExtension(os.path.basename(path))) or 'application/octet-stream'
+
+def leaseNotFound():
+    return jsonify({'error': 'Lease not found or expired'}), 410
+
+
+@app.route('/worker/lease', methods=['POST'])
+@auth.requireWorkerKey
+def leaseJob():
+    data = request.json
+
+    if 'worker' not in data:
+        return jsonify({'error': 'Expected "worker" argument'}), 400
+
+    lease = job.getJobManager().claimJob(str(data['worker']))
+
+    if lease is None:
+        return Response(status=204)
+
+    return jsonify(leaseToDict(lease)), 200
+
+
+@app.route('/worker/heartbeat', methods=['POST'])
+@auth.requireWorkerKey
+def heartbeat():
+    data = request.json
+
+    lease = job.getJobManager().renewLease(data.get('leaseId'), data.get('progress'))
+
+    if lease is None:
+        return leaseNotFound()
+
+    return jsonify(leaseToDict(lease)), 200
+
+
+@app.route('/worker/input', methods=['GET'])
+@auth.requireWorkerKey
+def downloadLeaseInput():
+    lease = job.getJobManager().getLease(request.args.get('lease'))
+
+    if lease is None:
+        return leaseNotFound()
+
+    # conditional=True makes werkzeug answer Range requests with 206
+    return send_file(lease.job.originalFilePath, mimetype=sourceMediaType(lease.job.originalFilePath), conditional=True)
+
+
+@app.route('/worker/output', methods=['GET'])
+@auth.requireWorkerKey
+def getLeaseOutput():
+    lease = job.getJobManager().getLease(request.args.get('lease'))
+
+    if lease is None:
+        return leaseNotFound()
+
+    return jsonify({'received': transfer.receivedBytes(lease.outputPartPath())}), 200
+
+
+@app.route('/worker/output', methods=['PUT'])
+@auth.requireWorkerKey
+def uploadLeaseOutput():
+    lease = job.getJobManager().getLease(request.args.get('lease'))
+
+    if lease is None:
+        return leaseNotFound()
+
+    contentRange = transfer.parseContentRange(request.headers.get('Content-Range'))
+
+    if contentRange is None:
+        return jsonify({'error': 'Expected "Content-Range: bytes start-end/total" header'}), 400
+
+    partPath = lease.outputPartPath()
+
+    try:
+        received = transfer.appendRange(partPath, request.stream, contentRange)
+    except ValueError as e:
+        return jsonify({'error': str(e), 'received': transfer.receivedBytes(partPath)}), 409
+
+    return jsonify({'received': received}), 200
+
+
+@app.route('/worker/complete', methods=['POST'])
+@auth.requireWorkerKey
+def completeLease():
+    data = request.json
+    jobManager = job.getJobManager()
+    lease = jobManager.getLease(data.get('leaseId'))
+
+    if lease is None:
+        return leaseNotFound()
+
+    partPath = lease.outputPartPath()
+    received = transfer.receivedBytes(partPath)
+
+    if received != data.get('sizeBytes'):
+        return jsonify({'error': f'Output incomplete, received {received} bytes', 'received': received}), 409
+
+    try:
+        startTimestamp = int(data['startTimestamp'])
+        endTimestamp = int(data['endTimestamp'])
+    except (KeyError, TypeError, ValueError):
+        return jsonify({'error': 'Expected integer "startTimestamp" and "endTimestamp" arguments'}), 400
+
+    scratch.publish(partPath, lease.job.destinationFilePath)
+    lease.job.saveStatistics(startTimestamp, endTimestamp)
+    jobManager.releaseLease(lease.leaseId, None)
+
+    return jsonify(lease.job.toDict()), 200
+
+
+@app.route('/worker/fail', methods=['POST'])
+@auth.requireWorkerKey
+def failLease():
+    data = request.json
+    jobManager = job.getJobManager()
+    lease = jobManager.releaseLease(data.get('leaseId'), Exception(f"Remote worker failed, {data.get('error')}"))
+
+    if lease is None:
+        return leaseNotFound()
+
+    return jsonify(lease.job.toDict()), 200
+
+
 def runJobManager():
     jobManager = job.getJobManager()
     jobManager.runBlocking()
@@ -161,10 +513,16 @@ if __name__ == '__main__':
                                 '%(message)s')
                         )
     logging.getLogger('werkzeug')
+    job.getJobManager().finishedListeners.append(lambda obj: admission.getAdmissionController().releaseEncode(obj.baseData.uuid))
+
     task = threading.Thread(target=runJobManager)
     task.daemon = True
     task.start()
 
+    leaseTask = threading.Thread(target=job.getJobManager().runLeaseReaper)
+    leaseTask.daemon = True
+    leaseTask.start()
+
     gcTask = threading.Thread(target=runFSGC)
     gcTask.daemon = True
     gcTask.start()
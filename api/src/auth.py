@@ -1,8 +1,15 @@
 import db
+import hmac
 import os
 import uuid
 from functools import wraps
 from flask import request, jsonify
+
+# Keys of remote encode workers, comma separated. They are separate from
+# client keys: a worker sees every client's sources and publishes their
+# outputs, a client key must never be able to do that.
+WORKER_API_KEYS = [key.strip() for key in os.environ.get("WORKER_API_KEYS", "").split(",") if key.strip()]
+
 def validApiKey(key: str):
     dbInstance = db.getDbInstance()
 
@@ -34,4 +41,20 @@ def requireApiKey(f):
         
         return f(*args, **kwargs)
     
-    return decorated_function
\ No newline at end of file
+    return decorated_function
+
+def validWorkerKey(key: str):
+    return any(hmac.compare_digest(key, workerKey) for workerKey in WORKER_API_KEYS)
+
+
+def requireWorkerKey(f):
+    @wraps(f)
+    def decorated_function(*args, **kwargs):
+        apikey = request.headers.get('X-API-Key')
+
+        if not apikey or not validWorkerKey(apikey):
+            return jsonify({"message": "Forbidden: Invalid worker key"}), 403
+
+        return f(*args, **kwargs)
+
+    return decorated_function
@@ -0,0 +1,124 @@
+import csv
+import os
+from dataclasses import dataclass
+from typing import Callable
+import ffmpeg
+import supervisor
+
+# Sources at least CHUNK_MIN_DURATION seconds long are encoded as chunks of
+# about CHUNK_SECONDS, so a restart only loses the chunk in progress. 0
+# disables chunking.
+CHUNK_SECONDS = float(os.environ.get("CHUNK_SECONDS", "300"))
+CHUNK_MIN_DURATION = float(os.environ.get("CHUNK_MIN_DURATION", str(30 * 60)))
+
+SEGMENT_LIST = "segments.csv"
+CONCAT_LIST = "concat.txt"
+
+
+@dataclass
+class Chunk:
+    index: int
+    start: float
+    end: float
+    completed: bool = False
+
+    def duration(self):
+        return self.end - self.start
+
+    def sourcePath(self, workdir: str):
+        return os.path.join(workdir, f"source_{self.index:05d}.mkv")
+
+    def encodedPath(self, workdir: str):
+        return os.path.join(workdir, f"encoded_{self.index:05d}.mkv")
+
+
+def parseSegmentList(lines: list[str]) -> list[Chunk]:
+    # Rows of the segment muxer's csv list are "filename,start,end"
+    chunks = []
+
+    for row in csv.reader(lines):
+        if len(row) != 3:
+            continue
+
+        chunks.append(Chunk(len(chunks), float(row[1]), float(row[2])))
+
+    return chunks
+
+
+def buildSplitCommand(location: str, workdir: str, chunkSeconds: float) -> list[str]:
+    # Stream copy cuts on keyframes only, so every chunk starts with one
+    # and decodes on its own.
+    return [
+        "ffmpeg", "-nostdin", "-hide_banner", "-nostats", "-progress", "pipe:1",
+        "-i", location,
+        "-map", "0:v:0", "-c", "copy",
+        "-f", "segment", "-segment_time", f"{chunkSeconds:.3f}", "-reset_timestamps", "1",
+        "-segment_list", os.path.join(workdir, SEGMENT_LIST), "-segment_list_type", "csv",
+        "-y", os.path.join(workdir, "source_%05d.mkv")
+    ]
+
+def buildChunkCommand(chunk: Chunk, workdir: str, config: ffmpeg.CompressVideoConfig, outpath: str) -> list[str]:
+    # Frame rate conversion pads the tail of the stream, without the cut to
+    # the segment's duration the padding adds up over the chunks.
+    return [
+        "ffmpeg", "-nostdin", "-hide_banner", "-nostats", "-progress", "pipe:1",
+        "-i", chunk.sourcePath(workdir),
+        "-filter:v", ffmpeg.scaleFilter(config.quality),
+    ] + ffmpeg.encodeArgs(config.location, config.factor, config.framerate, config.codec, config.preset, audio=False) + [
+        "-t", f"{chunk.duration():.6f}", "-f", "matroska", "-y", "-threads", "1",
+        outpath
+    ]
+
+def buildConcatCommand(workdir: str, location: str, outpath: str, codec: str) -> list[str]:
+    # Audio was left out of the chunks, it is taken from the source in one
+    # piece so there are no gaps at chunk boundaries.
+    profile = ffmpeg.getProfile(codec)
+
+    return [
+        "ffmpeg", "-nostdin", "-hide_banner", "-nostats", "-progress", "pipe:1",
+        "-f", "concat", "-safe", "0", "-i", os.path.join(workdir, CONCAT_LIST),
+        "-i", location,
+        "-map", "0:v", "-map", "1:a?",
+        "-c:v", "copy",
+    ] + profile.containerArgs + profile.audioArgs(ffmpeg.sourceExtension(location)) + [
+        "-y", outpath
+    ]
+
+
+async def runChecked(command: list[str], step: str, onProgress: Callable[[dict], None] | None = None, cleanupPaths: list[str] = []):
+    result = await supervisor.runProcess(command, ffmpeg.defaultLimits(), onProgress, cleanupPaths)
+
+    if result.returncode != 0:
+        supervisor.removePaths(cleanupPaths)
+        raise Exception(f"Unable to {step}, {os.linesep.join(result.stderrTail)}")
+
+
+async def splitSource(location: str, workdir: str, chunkSeconds: float = CHUNK_SECONDS) -> list[Chunk]:
+    await runChecked(buildSplitCommand(location, workdir, chunkSeconds), "split source into chunks")
+
+    with open(os.path.join(workdir, SEGMENT_LIST)) as f:
+        chunks = parseSegmentList(f.readlines())
+
+    if len(chunks) == 0:
+        raise Exception(f"Splitting '{location}' produced no chunks")
+
+    return chunks
+
+
+async def encodeChunk(chunk: Chunk, workdir: str, config: ffmpeg.CompressVideoConfig, onProgress: Callable[[dict], None] | None = None):
+    """
+    Encodes one chunk into its encodedPath. The file only appears under
+    that name once complete, a chunk found there after a crash is whole.
+    """
+    partPath = f"{chunk.encodedPath(workdir)}.part"
+
+    await runChecked(buildChunkCommand(chunk, workdir, config, partPath), f"encode chunk {chunk.index}", onProgress, [partPath])
+    os.replace(partPath, chunk.encodedPath(workdir))
+
+
+async def concatChunks(chunks: list[Chunk], workdir: str, location: str, outpath: str, codec: str):
+    with open(os.path.join(workdir, CONCAT_LIST), "w") as f:
+        for chunk in chunks:
+            f.write(f"file '{os.path.basename(chunk.encodedPath(workdir))}'\n")
+
+    await runChecked(buildConcatCommand(workdir, location, outpath, codec), "concatenate chunks", cleanupPaths=[outpath])
@@ -0,0 +1,157 @@
+import math
+from dataclasses import dataclass, field
+
+@dataclass(frozen=True)
+class PresetCost:
+    # Both relative to the codec's defaultPreset: speed as a multiple of its
+    # encode rate, size as a multiple of its output bytes at the same CRF.
+    speed: float
+    size: float
+
+
+@dataclass(frozen=True)
+class CodecProfile:
+    name: str
+    container: str
+    minCrf: int
+    maxCrf: int
+    # Ordered from fastest to slowest
+    presets: list[str]
+    defaultPreset: str
+    audioCodec: str
+    # Source containers whose audio can be copied as is
+    audioCopyFrom: list[str]
+    extraArgs: list[str] = field(default_factory=list)
+    # Muxer options, also needed when the stream is only copied
+    containerArgs: list[str] = field(default_factory=list)
+
+    def presetArgs(self, preset: str) -> list[str]:
+        if self.name == "libvpx-vp9":
+            return ["-deadline", "good", "-cpu-used", preset]
+
+        return ["-preset", preset]
+
+    def videoArgs(self, crf: int, preset: str) -> list[str]:
+        if preset not in self.presets:
+            raise Exception(f"Unknown preset '{preset}' for {self.name}")
+
+        return ["-c:v", self.name, "-crf", str(int(crf))] + self.presetArgs(preset) + self.extraArgs + self.containerArgs
+
+    def audioArgs(self, sourceExtension: str | None) -> list[str]:
+        if sourceExtension in self.audioCopyFrom:
+            return ["-c:a", "copy"]
+
+        return ["-c:a", self.audioCodec]
+
+    def presetRange(self, fastest: str, slowest: str) -> list[str]:
+        start = self.presets.index(fastest)
+        end = self.presets.index(slowest)
+
+        if start > end:
+            raise ValueError(f"Preset '{fastest}' is slower than '{slowest}'")
+
+        return self.presets[start:end + 1]
+
+
+X264_PRESETS = ["ultrafast", "superfast", "veryfast", "faster", "fast", "medium", "slow", "slower", "veryslow"]
+
+PROFILES: dict[str, CodecProfile] = {profile.name: profile for profile in [
+    CodecProfile("libx264", "mp4", 10, 50, X264_PRESETS, "medium", "aac", ["mp4"]),
+    # hvc1 tag so Apple players accept HEVC in mp4
+    CodecProfile("libx265", "mp4", 10, 50, X264_PRESETS, "medium", "aac", ["mp4"], containerArgs=["-tag:v", "hvc1"]),
+    # '-b:v 0' puts libvpx in constant quality mode, presets are cpu-used
+    CodecProfile("libvpx-vp9", "webm", 10, 63, ["5", "4", "3", "2", "1", "0"], "2", "libopus", ["webm"], ["-b:v", "0", "-row-mt", "1"]),
+    CodecProfile("libsvtav1", "mp4", 10, 63, ["12", "10", "8", "6", "4", "2"], "8", "aac", ["mp4"]),
+]}
+
+DEFAULT_CODEC = "libx264"
+
+# Rough starting figures per preset, replaced by measurements from
+# VideoCompressionStatistics as soon as enough jobs have finished.
+SEED_COSTS: dict[str, dict[str, PresetCost]] = {
+    "libx264": {
+        "ultrafast": PresetCost(8.0, 1.60), "superfast": PresetCost(6.0, 1.35), "veryfast": PresetCost(4.0, 1.20),
+        "faster": PresetCost(2.5, 1.10), "fast": PresetCost(1.8, 1.04), "medium": PresetCost(1.0, 1.00),
+        "slow": PresetCost(0.6, 0.97), "slower": PresetCost(0.3, 0.95), "veryslow": PresetCost(0.15, 0.93),
+    },
+    "libx265": {
+        "ultrafast": PresetCost(6.0, 1.45), "superfast": PresetCost(5.0, 1.35), "veryfast": PresetCost(3.2, 1.25),
+        "faster": PresetCost(2.4, 1.20), "fast": PresetCost(1.6, 1.06), "medium": PresetCost(1.0, 1.00),
+        "slow": PresetCost(0.4, 0.96), "slower": PresetCost(0.16, 0.93), "veryslow": PresetCost(0.06, 0.92),
+    },
+    "libvpx-vp9": {
+        "5": PresetCost(3.4, 1.18), "4": PresetCost(2.6, 1.12), "3": PresetCost(1.7, 1.06),
+        "2": PresetCost(1.0, 1.00), "1": PresetCost(0.43, 0.96), "0": PresetCost(0.14, 0.94),
+    },
+    "libsvtav1": {
+        "12": PresetCost(4.3, 1.45), "10": PresetCost(2.1, 1.22), "8": PresetCost(1.0, 1.00),
+        "6": PresetCost(0.43, 0.90), "4": PresetCost(0.14, 0.84), "2": PresetCost(0.05, 0.81),
+    },
+}
+
+# Presets need this many finished jobs before their measurements are used
+MIN_MEASUREMENTS = 5
+
+
+@dataclass
+class PresetMeasurement:
+    codec: str
+    preset: str
+    sourceBytesPerSecond: float
+    sizeRatio: float
+    count: int
+
+
+class CostModel:
+    def __init__(self):
+        self.costs = {codec: dict(costs) for codec, costs in SEED_COSTS.items()}
+
+    def cost(self, codec: str, preset: str) -> PresetCost:
+        return self.costs[codec][preset]
+
+    def calibrate(self, measurements: list[PresetMeasurement]):
+        """
+        Replaces seeds with measured figures for presets with at least
+        MIN_MEASUREMENTS jobs. Measurements are only comparable within a
+        codec, so they are scaled against the codec's most measured preset,
+        which keeps its seed cost. The default preset wins ties. A codec
+        without any such preset keeps its seeds.
+        """
+        byPreset = {(m.codec, m.preset): m for m in measurements if m.count >= MIN_MEASUREMENTS and m.sourceBytesPerSecond > 0 and m.sizeRatio > 0}
+
+        for codec, profile in PROFILES.items():
+            measured = [byPreset[(codec, preset)] for preset in profile.presets if (codec, preset) in byPreset]
+            if len(measured) == 0:
+                continue
+
+            reference = max(measured, key=lambda m: (m.count, m.preset == profile.defaultPreset))
+            anchor = SEED_COSTS[codec][reference.preset]
+
+            for m in measured:
+                self.costs[codec][m.preset] = PresetCost(
+                    anchor.speed * m.sourceBytesPerSecond / reference.sourceBytesPerSecond,
+                    anchor.size * m.sizeRatio / reference.sizeRatio
+                )
+
+    def choosePreset(self, profile: CodecProfile, fastest: str, slowest: str, pressure: float) -> str:
+        """
+        Maps pressure onto encode speed within the range, on a log scale
+        since preset speeds are spread geometrically: 0 (idle queue) picks
+        the slowest preset, 1 the fastest. Presets that are both slower and
+        larger than another one in range are never picked.
+        """
+        candidates = [(preset, self.cost(profile.name, preset)) for preset in profile.presetRange(fastest, slowest)]
+        efficient = [(preset, cost) for preset, cost in candidates if not any(
+            other.speed >= cost.speed and other.size <= cost.size and other != cost for _, other in candidates
+        )]
+
+        pressure = min(1.0, max(0.0, pressure))
+        low = math.log(min(cost.speed for _, cost in efficient))
+        high = math.log(max(cost.speed for _, cost in efficient))
+        target = low + pressure * (high - low)
+
+        return min(efficient, key=lambda pair: (abs(math.log(pair[1].speed) - target), pair[1].size))[0]
+
+
+def getProfile(name: str) -> CodecProfile | None:
+    return PROFILES.get(name)
@@ -0,0 +1,147 @@
+import logging
+import os
+import re
+import tempfile
+from dataclasses import dataclass
+import codec_profiles
+import ffmpeg
+import supervisor
+
+QUALITY_METRICS = ["ssim", "psnr"]
+
+# Candidate CRFs are judged on SAMPLE_COUNT clips of SAMPLE_SECONDS spread
+# evenly over the source, the worst clip decides.
+SAMPLE_COUNT = int(os.environ.get("CRF_SEARCH_SAMPLE_COUNT", "3"))
+SAMPLE_SECONDS = float(os.environ.get("CRF_SEARCH_SAMPLE_SECONDS", "4"))
+DEFAULT_MIN_CRF = 18
+
+SSIM_SCORE = re.compile(r"SSIM .*All:([0-9.]+)")
+PSNR_SCORE = re.compile(r"PSNR .*average:([0-9.]+|inf)")
+
+
+@dataclass
+class QualityTarget:
+    metric: str
+    value: float
+
+
+@dataclass
+class CrfSearchResult:
+    crf: int
+    score: float
+
+
+def sampleOffsets(duration: float) -> list[tuple[float, float]]:
+    if duration <= SAMPLE_SECONDS * SAMPLE_COUNT:
+        return [(0, duration)]
+
+    step = duration / (SAMPLE_COUNT + 1)
+    return [(step * (i + 1) - SAMPLE_SECONDS / 2, SAMPLE_SECONDS) for i in range(SAMPLE_COUNT)]
+
+
+def parseQualityScore(metric: str, lines: list[str]) -> float | None:
+    pattern = SSIM_SCORE if metric == "ssim" else PSNR_SCORE
+
+    for line in reversed(lines):
+        match = pattern.search(line)
+        if match is not None:
+            return float(match.group(1))
+
+    return None
+
+
+async def probeDuration(location: str) -> float:
+    result = await supervisor.runProcess(["ffprobe", "-v", "error", "-show_entries", "format=duration", "-of", "default=nw=1", location], ffmpeg.defaultLimits())
+
+    try:
+        return float(result.stdoutValues["duration"])
+    except (KeyError, ValueError):
+        raise Exception(f"Unable to probe duration of '{location}'")
+
+
+def buildSampleCommand(location: str, offset: float, seconds: float, crf: int, quality: str, outpath: str, profile: codec_profiles.CodecProfile, preset: str) -> list[str]:
+    # Samples go through the same codec and preset as the final encode,
+    # CRF scales are not comparable across either.
+    return [
+        "ffmpeg", "-nostdin", "-hide_banner", "-nostats", "-progress", "pipe:1",
+        "-ss", f"{offset:.3f}", "-t", f"{seconds:.3f}", "-i", location,
+        "-an", "-filter:v", ffmpeg.scaleFilter(quality),
+    ] + profile.videoArgs(crf, preset) + [
+        "-y", "-threads", "1",
+        outpath
+    ]
+
+def buildMeasureCommand(samplePath: str, location: str, offset: float, seconds: float, quality: str, metric: str) -> list[str]:
+    # The reference is the same source range, scaled the same way, so the
+    # metric only sees the loss introduced by the CRF.
+    return [
+        "ffmpeg", "-nostdin", "-hide_banner", "-nostats", "-progress", "pipe:1",
+        "-i", samplePath,
+        "-ss", f"{offset:.3f}", "-t", f"{seconds:.3f}", "-i", location,
+        "-lavfi", f"[1:v]{ffmpeg.scaleFilter(quality)}[ref];[0:v][ref]{metric}",
+        "-f", "null", "-"
+    ]
+
+
+async def runChecked(command: list[str]) -> supervisor.ProcessResult:
+    result = await supervisor.runProcess(command, ffmpeg.defaultLimits())
+
+    if result.returncode != 0:
+        raise Exception(f"CRF search step failed, {os.linesep.join(result.stderrTail)}")
+
+    return result
+
+
+async def measureCrf(location: str, quality: str, metric: str, crf: int, samples: list[tuple[float, float]], workdir: str, profile: codec_profiles.CodecProfile, preset: str) -> float:
+    scores = []
+
+    for index, (offset, seconds) in enumerate(samples):
+        samplePath = os.path.join(workdir, f"sample_{index}_{crf}.{profile.container}")
+
+        await runChecked(buildSampleCommand(location, offset, seconds, crf, quality, samplePath, profile, preset))
+        result = await runChecked(buildMeasureCommand(samplePath, location, offset, seconds, quality, metric))
+        supervisor.removePaths([samplePath])
+
+        score = parseQualityScore(metric, result.stderrTail)
+        if score is None:
+            raise Exception(f"Unable to read {metric} score for sample {index} at CRF {crf}")
+
+        scores.append(score)
+
+    return min(scores)
+
+
+async def searchCrf(location: str, quality: str, target: QualityTarget, minCrf: int, codec: str = codec_profiles.DEFAULT_CODEC, preset: str | None = None) -> CrfSearchResult:
+    """
+    Binary searches [minCrf, profile.maxCrf] for the highest CRF whose worst
+    sample still meets the target, assuming quality falls as CRF rises. If
+    even minCrf misses the target, minCrf is returned with its score.
+    """
+    profile = codec_profiles.getProfile(codec)
+    preset = preset or profile.defaultPreset
+    maxCrf = profile.maxCrf
+    samples = sampleOffsets(await probeDuration(location))
+    scores: dict[int, float] = {}
+
+    with tempfile.TemporaryDirectory(prefix="crf-search-") as workdir:
+        low, high = minCrf, maxCrf
+        best = None
+
+        while low <= high:
+            crf = (low + high) // 2
+            scores[crf] = await measureCrf(location, quality, target.metric, crf, samples, workdir, profile, preset)
+            logging.debug(f"CRF {crf} scored {target.metric}={scores[crf]}")
+
+            if scores[crf] >= target.value:
+                best = crf
+                low = crf + 1
+            else:
+                high = crf - 1
+
+        if best is None:
+            best = minCrf
+            if best not in scores:
+                scores[best] = await measureCrf(location, quality, target.metric, best, samples, workdir, profile, preset)
+
+    logging.info(f"Chose CRF {best} for {target.metric} target {target.value} (measured {scores[best]})")
+    return CrfSearchResult(best, scores[best])
@@ -69,6 +69,78 @@ class DB:
 
 _instance = None
 
+# Columns added after their table first shipped. schema.sql only creates
+# tables that don't exist yet, so older databases get them here.
+MIGRATION_COLUMNS = [
+    ("jobs", "owner", "TEXT"),
+    ("jobs", "attempts", "INT NOT NULL DEFAULT 0"),
+    ("VideoCompressionJob", "artifacts", "TEXT NOT NULL DEFAULT ''"),
+    ("VideoCompressionJob", "targetMetric", "TEXT"),
+    ("VideoCompressionJob", "targetValue", "REAL"),
+    ("VideoCompressionJob", "measuredQuality", "REAL"),
+    ("VideoCompressionStatistics", "crf", "INT"),
+    ("VideoCompressionStatistics", "qualityMetric", "TEXT"),
+    ("VideoCompressionStatistics", "qualityScore", "REAL"),
+    ("VideoCompressionJob", "codec", "TEXT NOT NULL DEFAULT 'libx264'"),
+    ("VideoCompressionJob", "presetFastest", "TEXT"),
+    ("VideoCompressionJob", "presetSlowest", "TEXT"),
+    ("VideoCompressionJob", "preset", "TEXT"),
+    ("VideoCompressionStatistics", "codec", "TEXT"),
+    ("VideoCompressionStatistics", "preset", "TEXT"),
+    ("VideoCompressionJob", "chunked", "BOOLEAN NOT NULL DEFAULT 0"),
+]
+
+# Tables whose constraints changed. SQLite can't alter a CHECK constraint,
+# so a table whose definition lacks the marker is copied into a new one.
+TABLE_REBUILDS = [
+    # Renaming the old table away would rewrite the foreign keys pointing at
+    # it, so the new one is built under another name and renamed into place.
+    ("jobs", "'CANCELLED'", """
+        PRAGMA foreign_keys=OFF;
+
+        BEGIN;
+
+        CREATE TABLE jobs_new (
+            uuid UUID PRIMARY KEY,
+            state TEXT CHECK(state IN ('PENDING', 'COMPLETED', 'FAILED', 'CANCELLED')),
+            type TEXT CHECK(type IN ('VIDEO_COMPRESSION_JOB')),
+            createdAt TIMESTAMP NOT NULL,
+            expiresAt TIMESTAMP,
+            owner TEXT,
+            attempts INT NOT NULL DEFAULT 0
+        );
+
+        INSERT INTO jobs_new (uuid, state, type, createdAt, expiresAt, owner, attempts)
+        SELECT uuid, state, type, createdAt, expiresAt, owner, attempts FROM jobs;
+
+        DROP TABLE jobs;
+
+        ALTER TABLE jobs_new RENAME TO jobs;
+
+        COMMIT;
+
+        PRAGMA foreign_keys=ON;
+    """),
+]
+
+def runMigrations(db: DB):
+    for table, column, declaration in MIGRATION_COLUMNS:
+        existing = db.runGetQuery(f"PRAGMA table_info({table})")
+
+        if len(existing) == 0:
+            continue
+
+        if column not in [row[1] for row in existing]:
+            logging.info(f"Adding column '{column}' to '{table}'")
+            db.runUpdateQuery(f"ALTER TABLE {table} ADD COLUMN {column} {declaration}")
+
+    for table, marker, script in TABLE_REBUILDS:
+        existing = db.runGetQuery("SELECT sql FROM sqlite_master WHERE type = 'table' AND name = ?", [table])
+
+        if len(existing) == 1 and marker not in existing[0][0]:
+            logging.info(f"Rebuilding table '{table}'")
+            db.runScript(script)
+
 def runStartupSchema(db: DB):
     script = None
     with open("/app/schema.sql") as f:
@@ -76,6 +148,7 @@ def runStartupSchema(db: DB):
 
     logging.info("Updating schema ...")
     try:
+        runMigrations(db)
         db.runScript(script)
     except Exception as e:
         logging.error("Failed to run update schema, exiting")
@@ -4,12 +4,21 @@ import uuid
 
 
 
+MEDIA_TYPES = {
+    'video/mp4': "mp4",
+    'video/webm': "webm",
+    'video/quicktime': "mov",
+    'video/x-matroska': "mkv",
+}
+
 def isMediaTypeAllowed(type: str):
-    return type in ['video/mp4']
+    return type in MEDIA_TYPES
 
 def mediaTypeToExtension(type: str):
-    if type == 'video/mp4':
-        return "mp4"
+    return MEDIA_TYPES.get(type)
+
+def extensionToMediaType(extension: str):
+    return next((mediaType for mediaType, ext in MEDIA_TYPES.items() if ext == extension), None)
     
 def extractExtension(name: str):
 
@@ -24,5 +33,5 @@ def extractExtension(name: str):
     return split[1]
 
 def generateFileNameByMedia(type: str):
-    if type =='video/mp4':
-        return f"{str(uuid.uuid4())}.mp4"
\ No newline at end of file
+    if type in MEDIA_TYPES:
+        return f"{str(uuid.uuid4())}.{MEDIA_TYPES[type]}"
\ No newline at end of file
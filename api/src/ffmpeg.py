@@ -1,7 +1,64 @@
-import subprocess
-from dataclasses import dataclass
-import subprocess
+from dataclasses import dataclass, field
+import glob
 import logging
+import os
+from typing import Callable
+import codec_profiles
+import supervisor
+
+# Seconds an encode may run in total, and may go without advancing its
+# output timestamp, before it is killed.
+WALL_TIMEOUT = float(os.environ.get("ENCODE_WALL_TIMEOUT", str(6 * 60 * 60)))
+NO_PROGRESS_TIMEOUT = float(os.environ.get("ENCODE_NO_PROGRESS_TIMEOUT", str(10 * 60)))
+
+QUALITY_HEIGHTS = {"480p": 480, "720p": 720, "1080p": 1080, "1440p": 1440, "2160p": 2160}
+
+ARTIFACT_KINDS = ["poster", "sprite", "preview"]
+
+# One sprite thumbnail every SPRITE_INTERVAL seconds, SPRITE_COLUMNS x
+# SPRITE_ROWS thumbnails per sheet.
+SPRITE_INTERVAL = int(os.environ.get("SPRITE_INTERVAL", "10"))
+SPRITE_COLUMNS = 10
+SPRITE_ROWS = 10
+SPRITE_WIDTH = 160
+POSTER_HEIGHT = 720
+PREVIEW_SECONDS = int(os.environ.get("PREVIEW_SECONDS", "6"))
+PREVIEW_HEIGHT = 240
+
+@dataclass
+class ArtifactConfig:
+    posterPath: str | None = None
+    # printf-style pattern, a long video produces several sheets
+    spritePattern: str | None = None
+    previewPath: str | None = None
+
+    def kinds(self):
+        return [kind for kind, path in [("poster", self.posterPath), ("sprite", self.spritePattern), ("preview", self.previewPath)] if path is not None]
+
+    def producedPaths(self) -> dict[str, list[str]]:
+        produced = {}
+        if self.posterPath is not None:
+            produced["poster"] = [self.posterPath] if os.path.exists(self.posterPath) else []
+        if self.spritePattern is not None:
+            produced["sprite"] = sorted(glob.glob(self.spritePattern.replace("%03d", "[0-9][0-9][0-9]")))
+        if self.previewPath is not None:
+            produced["preview"] = [self.previewPath] if os.path.exists(self.previewPath) else []
+        return produced
+
+    def removeProduced(self):
+        for paths in self.producedPaths().values():
+            supervisor.removePaths(paths)
+
+
+def artifactConfigFor(outpath: str, kinds: list[str]) -> ArtifactConfig:
+    stem = os.path.splitext(outpath)[0]
+    return ArtifactConfig(
+        f"{stem}_poster.jpg" if "poster" in kinds else None,
+        f"{stem}_sprite_%03d.jpg" if "sprite" in kinds else None,
+        f"{stem}_preview.mp4" if "preview" in kinds else None
+    )
+
+
 @dataclass
 class CompressVideoConfig:
     outpath: str
@@ -9,6 +66,9 @@ class CompressVideoConfig:
     factor: int
     framerate: int
     quality: str
+    artifacts: ArtifactConfig = field(default_factory=ArtifactConfig)
+    codec: str = codec_profiles.DEFAULT_CODEC
+    preset: str | None = None
 
 
 def isInteger(number: int):
@@ -18,25 +78,95 @@ def isInteger(number: int):
     except Exception:
         return False
 
-def buildCompressionCommand(location: str, factor: int, framerate: int, outpath: str, quality: str):
+def scaleFilter(quality: str) -> str:
+    ypixels = QUALITY_HEIGHTS[quality]
+
+    return f"scale=trunc(oh*a/2)*2:{str(ypixels)}"
+
+
+def buildArtifactGraph(artifacts: ArtifactConfig, mainFilter: str) -> tuple[str, list[str]]:
+    """
+    Splits the decoded video into the main output plus one branch per
+    artifact, so every artifact comes out of the same decode as the encode.
+    Returns the filter_complex graph and the output arguments of the
+    artifact branches.
+    """
+    kinds = artifacts.kinds()
+    labels = "".join(f"[{kind}in]" for kind in kinds)
+    graph = [f"[0:v]split={len(kinds) + 1}[mainin]{labels}", f"[mainin]{mainFilter}[main]"]
+    outputs = []
+
+    if artifacts.posterPath is not None:
+        graph.append(f"[posterin]thumbnail=100,scale=-2:{POSTER_HEIGHT}[poster]")
+        outputs += ["-map", "[poster]", "-frames:v", "1", "-update", "1", artifacts.posterPath]
+
+    if artifacts.spritePattern is not None:
+        graph.append(f"[spritein]fps=1/{SPRITE_INTERVAL},scale={SPRITE_WIDTH}:-2,tile={SPRITE_COLUMNS}x{SPRITE_ROWS}[sprite]")
+        outputs += ["-map", "[sprite]", "-fps_mode", "passthrough", artifacts.spritePattern]
+
+    if artifacts.previewPath is not None:
+        graph.append(f"[previewin]trim=duration={PREVIEW_SECONDS},setpts=PTS-STARTPTS,scale=-2:{PREVIEW_HEIGHT}[preview]")
+        outputs += ["-map", "[preview]", "-an", "-c:v", "libx264", "-preset", "veryfast", "-crf", "32", artifacts.previewPath]
+
+    return ";".join(graph), outputs
+
+
+def sourceExtension(location: str) -> str | None:
+    return os.path.splitext(location)[1].lstrip(".").lower() or None
+
+def getProfile(codec: str) -> codec_profiles.CodecProfile:
+    profile = codec_profiles.getProfile(codec)
+
+    if profile is None:
+        raise Exception(f"Cannot build command, unknown codec '{codec}'")
+
+    return profile
+
+def encodeArgs(location: str, factor: int, framerate: int, codec: str, preset: str | None, audio: bool = True) -> list[str]:
+    profile = getProfile(codec)
+    args = ["-fpsmax", str(int(framerate))] + profile.videoArgs(factor, preset or profile.defaultPreset)
+
+    if not audio:
+        return args + ["-an"]
+
+    return args + profile.audioArgs(sourceExtension(location))
+
+def buildCompressionCommand(location: str, factor: int, framerate: int, outpath: str, quality: str, artifacts: ArtifactConfig = ArtifactConfig(), codec: str = codec_profiles.DEFAULT_CODEC, preset: str | None = None) -> list[str]:
 
     if not isInteger(factor) or not isInteger(framerate):
         raise Exception("Cannot build command, expected int parameters")
-    
-    ypixels = 720
-    if quality == "1080p":
-        ypixels = 1080
 
-    return f'ffmpeg -i {location} -fpsmax {str(framerate)} -crf {str(factor)} -c:v libx264 -filter:v scale="trunc(oh*a/2)*2:{str(ypixels)}" -y -threads 1 {outpath}'
-    
+    scale = scaleFilter(quality)
+    encode = encodeArgs(location, factor, framerate, codec, preset)
+    command = ["ffmpeg", "-nostdin", "-hide_banner", "-nostats", "-progress", "pipe:1", "-i", location]
+
+    if len(artifacts.kinds()) == 0:
+        return command + encode + ["-filter:v", scale, "-y", "-threads", "1", outpath]
+
+    graph, artifactOutputs = buildArtifactGraph(artifacts, scale)
+
+    return command + [
+        "-filter_complex", graph, "-y", "-threads", "1",
+        "-map", "[main]", "-map", "0:a?",
+    ] + encode + [outpath] + artifactOutputs
+
 
-def compressVideo(config: CompressVideoConfig):
-    
-    command = buildCompressionCommand(config.location, config.factor, config.framerate, config.outpath, config.quality)
+def defaultLimits() -> supervisor.ProcessLimits:
+    return supervisor.ProcessLimits(WALL_TIMEOUT, NO_PROGRESS_TIMEOUT)
 
-    result = subprocess.run(command, shell=True, capture_output=True)
+async def compressVideo(config: CompressVideoConfig, limits: supervisor.ProcessLimits | None = None, onProgress: Callable[[dict], None] | None = None):
+
+    command = buildCompressionCommand(config.location, config.factor, config.framerate, config.outpath, config.quality, config.artifacts, config.codec, config.preset)
+
+    try:
+        result = await supervisor.runProcess(command, limits or defaultLimits(), onProgress, cleanupPaths=[config.outpath])
+    except BaseException:
+        config.artifacts.removeProduced()
+        raise
 
     if result.returncode != 0:
-        raise Exception(f"Unable to compress video, {result.stderr}")
-    
-    logging.debug(result.stdout)
\ No newline at end of file
+        supervisor.removePaths([config.outpath])
+        config.artifacts.removeProduced()
+        raise Exception(f"Unable to compress video, {os.linesep.join(result.stderrTail)}")
+
+    logging.debug(os.linesep.join(result.stderrTail))
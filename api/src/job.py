@@ -3,18 +3,52 @@ import uuid
 import db
 import abc
 from enum import Enum
-from dataclasses import dataclass
+from dataclasses import dataclass, field
 import logging
 from datetime import datetime, timedelta
 import threading
 import os
+from collections import deque
+import concurrent.futures
 import job_statistics
+import codec_profiles
 import ffmpeg
+import crf_search
+import chunked
+import supervisor
+import scratch
+import asyncio
+import hashlib
+import time
+from typing import Callable
+
+# Number of pending jobs hydrated into memory at a time, the rest of the
+# backlog stays in the database until the window drains.
+PREFETCH_WINDOW = int(os.environ.get("JOB_PREFETCH_WINDOW", "32"))
+
+# Number of jobs the manager runs at the same time.
+ENCODE_SLOTS = int(os.environ.get("ENCODE_SLOTS", "1"))
+
+# How many times a job killed for making no progress is put back in the
+# queue before it is marked as failed.
+STALL_MAX_RETRIES = int(os.environ.get("ENCODE_STALL_MAX_RETRIES", "1"))
+
+# Seconds a remote worker holds a job without a heartbeat before the job
+# goes back to the queue.
+LEASE_SECONDS = float(os.environ.get("WORKER_LEASE_SECONDS", "60"))
+
+# Estimated queue drain time at which jobs get the fastest preset their
+# range allows. Below it the preset slides towards the slowest one.
+PRESET_PRESSURE_DRAIN_SECONDS = float(os.environ.get("PRESET_PRESSURE_DRAIN_SECONDS", str(60 * 60)))
+
+# Seconds before a job that didn't get its scratch reservation is retried
+SCRATCH_RETRY_SECONDS = float(os.environ.get("SCRATCH_RETRY_SECONDS", "30"))
 
 class JobState(Enum):
     PENDING = "PENDING",
     COMPLETED = "COMPLETED"
     FAILED = "FAILED"
+    CANCELLED = "CANCELLED"
 
 class JobType(Enum):
     VIDEO_COMPRESSION_JOB = "VIDEO_COMPRESSION_JOB"
@@ -26,6 +60,8 @@ class BaseJobData:
     type: JobType
     createdAt: datetime
     expiresAt: datetime | None
+    owner: str | None = None
+    attempts: int = 0
 
 @dataclass
 class VideoCompressorJobData:
@@ -35,12 +71,28 @@ class VideoCompressorJobData:
     quality: str
     factor: int
     framerate: str
+    artifacts: list[str] = field(default_factory=list)
+    # When set, factor is the lowest CRF the search may pick
+    target: crf_search.QualityTarget | None = None
+    measuredQuality: float | None = None
+    codec: str = codec_profiles.DEFAULT_CODEC
+    # (fastest, slowest), the codec's default preset when not set
+    presetRange: tuple[str, str] | None = None
+    # Chosen from presetRange when the job starts
+    preset: str | None = None
+    # Set once the source was split, the job then resumes from its chunks
+    chunked: bool = False
 
 
 class Job:
     def __init__(self, data: BaseJobData):
         self.baseData = data
+        self.cancelRequested = False
+        # time.monotonic() before which the dispatcher skips the job
+        self.notBefore = 0.0
 
+    def isRemoteCapable(self):
+        return True
 
     def isExpired(self):
         if self.baseData.expiresAt == None:
@@ -60,41 +112,55 @@ class Job:
     def setFailed(self):
         self.baseData.state = JobState.FAILED
 
+    def setCancelled(self):
+        self.baseData.state = JobState.CANCELLED
+
     def save(self):
+        # Every persisted change invalidates the /jobs ETag
+        self.persist()
+        getJobManager().touch()
+
+    def persist(self):
         dbInstance = db.getDbInstance()
 
         result = dbInstance.runGetQuery("SELECT * FROM jobs WHERE uuid = ?", [self.baseData.uuid])
 
         if len(result) == 0:
-            dbInstance.runUpdateQuery("INSERT INTO jobs (uuid, state, type, createdAt, expiresAt) VALUES (?,?,?,?,?)", [
+            dbInstance.runUpdateQuery("INSERT INTO jobs (uuid, state, type, createdAt, expiresAt, owner, attempts) VALUES (?,?,?,?,?,?,?)", [
                 self.baseData.uuid,
                 self.baseData.state.name,
                 self.baseData.type.name,
                 self.baseData.createdAt,
-                self.baseData.expiresAt
+                self.baseData.expiresAt,
+                self.baseData.owner,
+                self.baseData.attempts
             ]) 
 
             return
 
-        dbInstance.runUpdateQuery("UPDATE jobs SET state=?,createdAt=?,expiresAt=? WHERE uuid=?", [
+        dbInstance.runUpdateQuery("UPDATE jobs SET state=?,createdAt=?,expiresAt=?,attempts=? WHERE uuid=?", [
             self.baseData.state.name,
             self.baseData.createdAt,
             self.baseData.expiresAt,
+            self.baseData.attempts,
             self.baseData.uuid
         ])
         
 
     @abc.abstractmethod
-    def run(self):
+    async def runAsync(self):
         pass
 
+    def start(self) -> supervisor.SupervisedTask:
+        return supervisor.getSupervisor().submit(self.runAsync())
+
     def toDict(self):
         return {
             "uuid" : self.baseData.uuid,
             "expiresAt": self.baseData.expiresAt.isoformat() if self.baseData.expiresAt is not None else None,
             "createdAt": self.baseData.createdAt.isoformat(),
             "state": self.baseData.state.name,
-            
+            "type": self.baseData.type.name,
         } 
 class VideoCompressionJob(Job):
     def __init__(self, videoData: VideoCompressorJobData):
@@ -105,28 +171,195 @@ class VideoCompressionJob(Job):
         self.framerate = videoData.framerate
         self.factor = videoData.factor
         self.quality = videoData.quality
-    
+        self.artifacts = videoData.artifacts
+        self.target = videoData.target
+        self.measuredQuality = videoData.measuredQuality
+        self.codec = videoData.codec
+        self.presetRange = videoData.presetRange
+        self.preset = videoData.preset
+        self.chunked = videoData.chunked
+        # Seconds of output encoded so far, only known while running
+        self.progress: float | None = None
+        # Probed once, when deciding whether to chunk
+        self.sourceDuration: float | None = None
+
+    def setProgress(self, values: dict, offset: float = 0.0):
+        outTimeUs = supervisor.parseInt(values.get("out_time_us"))
+        if outTimeUs >= 0:
+            self.progress = offset + outTimeUs / 1000000
+
+    def choosePreset(self, pressure: float):
+        profile = codec_profiles.getProfile(self.codec)
+        fastest, slowest = self.presetRange or (profile.defaultPreset, profile.defaultPreset)
+
+        self.preset = job_statistics.getCostModel().choosePreset(profile, fastest, slowest, pressure)
+        logging.info(f"Chose preset '{self.preset}' for job {self.baseData.uuid} at pressure {pressure:.2f}")
+        self.save()
+
+    async def runAsync(self):
+        if self.target is not None and self.measuredQuality is None:
+            logging.info("Searching CRF for quality target ...")
+            result = await crf_search.searchCrf(self.originalFilePath, self.quality, self.target, self.factor, self.codec, self.preset)
+            self.factor = result.crf
+            self.measuredQuality = result.score
+            await asyncio.to_thread(self.save)
 
-    def run(self):
         logging.info("Running compression ...")
 
+        # Everything is written to scratch and only published once complete
+        outpath = scratch.getScratchSpace().pathFor(self.baseData.uuid, self.destinationFilePath)
+
         config = ffmpeg.CompressVideoConfig(
-            self.destinationFilePath,
+            outpath,
             self.originalFilePath,
             self.factor,
             self.framerate,
-            self.quality
+            self.quality,
+            ffmpeg.artifactConfigFor(outpath, self.artifacts),
+            self.codec,
+            self.preset
         )
         
         start = datetime.now()
-        ffmpeg.compressVideo(config)
+        if await self.shouldChunk():
+            await self.runChunked(config)
+        else:
+            await ffmpeg.compressVideo(config, onProgress=self.setProgress)
         end = datetime.now()
+
+        # Everything blocking runs off the supervisor loop, which keeps
+        # reading the output of every other encode meanwhile
+        artifacts = await asyncio.to_thread(self.publishOutputs, outpath, config.artifacts.producedPaths())
+        await asyncio.to_thread(self.saveArtifacts, artifacts)
+        await asyncio.to_thread(self.saveStatistics, int(start.timestamp()), int(end.timestamp()))
+
+    async def shouldChunk(self) -> bool:
+        if self.chunked:
+            return True
+
+        # Artifacts are cut from the single decode of a whole-file encode
+        if chunked.CHUNK_SECONDS <= 0 or len(self.artifacts) > 0:
+            return False
+
+        if self.sourceDuration is None:
+            self.sourceDuration = await crf_search.probeDuration(self.originalFilePath)
+
+        return self.sourceDuration >= chunked.CHUNK_MIN_DURATION
+
+    async def runChunked(self, config: ffmpeg.CompressVideoConfig):
+        workdir = os.path.dirname(config.outpath)
+        chunks = await asyncio.to_thread(self.loadChunks)
+
+        # A chunk whose encode is gone is encoded again from its source
+        for chunk in chunks:
+            if chunk.completed and not os.path.exists(chunk.encodedPath(workdir)):
+                chunk.completed = False
+
+        # Without the source either, scratch was lost and the split starts over
+        if any(not chunk.completed and not os.path.exists(chunk.sourcePath(workdir)) for chunk in chunks):
+            logging.warning(f"Chunks of job {self.baseData.uuid} are missing from scratch, splitting again")
+            chunks = []
+
+        if len(chunks) == 0:
+            logging.info("Splitting source into chunks ...")
+            chunks = await chunked.splitSource(self.originalFilePath, workdir)
+            await asyncio.to_thread(self.saveChunks, chunks)
+            self.chunked = True
+            await asyncio.to_thread(self.save)
+        else:
+            logging.info(f"Resuming after {sum(chunk.completed for chunk in chunks)} of {len(chunks)} chunks")
+
+        encoded = 0.0
+        for chunk in chunks:
+            if not chunk.completed:
+                await chunked.encodeChunk(chunk, workdir, config, lambda values: self.setProgress(values, encoded))
+                await asyncio.to_thread(self.markChunkCompleted, chunk)
+                await asyncio.to_thread(supervisor.removePaths, [chunk.sourcePath(workdir)])
+
+            encoded += chunk.duration()
+
+        logging.info(f"Concatenating {len(chunks)} chunks ...")
+        await chunked.concatChunks(chunks, workdir, self.originalFilePath, config.outpath, self.codec)
+
+    def loadChunks(self) -> list[chunked.Chunk]:
+        dbInstance = db.getDbInstance()
+
+        rows = dbInstance.runGetQuery("SELECT idx, startTime, endTime, completed FROM VideoChunk WHERE job = ? ORDER BY idx", [self.baseData.uuid])
+
+        return [chunked.Chunk(row[0], row[1], row[2], bool(row[3])) for row in rows]
+
+    def saveChunks(self, chunks: list[chunked.Chunk]):
+        dbInstance = db.getDbInstance()
+
+        dbInstance.runUpdateQuery("DELETE FROM VideoChunk WHERE job = ?", [self.baseData.uuid])
+        for chunk in chunks:
+            dbInstance.runUpdateQuery("INSERT INTO VideoChunk (job, idx, startTime, endTime, completed) VALUES (?,?,?,?,?)", [
+                self.baseData.uuid,
+                chunk.index,
+                chunk.start,
+                chunk.end,
+                chunk.completed
+            ])
+
+    def markChunkCompleted(self, chunk: chunked.Chunk):
+        dbInstance = db.getDbInstance()
+
+        chunk.completed = True
+        dbInstance.runUpdateQuery("UPDATE VideoChunk SET completed = 1 WHERE job = ? AND idx = ?", [self.baseData.uuid, chunk.index])
+
+    def publishOutputs(self, outpath: str, produced: dict[str, list[str]]) -> dict[str, list[str]]:
+        # Artifacts first, so the output never shows up without them
+        folder = os.path.dirname(self.destinationFilePath)
+        published = {}
+
+        for kind, paths in produced.items():
+            published[kind] = []
+            for path in paths:
+                destination = os.path.join(folder, os.path.basename(path))
+                scratch.publish(path, destination)
+                published[kind].append(destination)
+
+        scratch.publish(outpath, self.destinationFilePath)
+        return published
+
+    def estimateScratchBytes(self, includeSource: bool = False) -> int:
+        # A chunked encode also holds a stream copy of the source. A resumed
+        # one already occupies part of that in its workdir.
+        sourceSize = os.path.getsize(self.originalFilePath)
+        sizeBytes = int(job_statistics.estimateOutputBytes(sourceSize) * scratch.SCRATCH_RESERVE_MARGIN)
+
+        if includeSource:
+            sizeBytes += sourceSize
+
+        return max(0, sizeBytes - scratch.getScratchSpace().usedBytes(self.baseData.uuid))
+
+    def isRemoteCapable(self):
+        # Workers only upload the main output, don't search CRFs and can't
+        # resume from chunks encoded here
+        return len(self.artifacts) == 0 and (self.target is None or self.measuredQuality is not None) and not self.chunked
+
+    def saveArtifacts(self, produced: dict[str, list[str]]):
+        dbInstance = db.getDbInstance()
+
+        for kind, paths in produced.items():
+            for path in paths:
+                dbInstance.runUpdateQuery("INSERT INTO VideoArtifact (job, kind, path) VALUES (?,?,?)", [self.baseData.uuid, kind, path])
+
+    def getArtifacts(self) -> dict[str, list[str]]:
+        dbInstance = db.getDbInstance()
+
+        rows = dbInstance.runGetQuery("SELECT kind, path FROM VideoArtifact WHERE job = ? ORDER BY kind, path", [self.baseData.uuid])
+
+        artifacts = {kind: [] for kind in self.artifacts}
+        for row in rows:
+            artifacts.setdefault(row[0], []).append(row[1])
+
+        return artifacts
+
+    def saveStatistics(self, startTimestamp: int, endTimestamp: int):
         originalSize = os.stat(self.originalFilePath).st_size
         finalSize = os.stat(self.destinationFilePath).st_size
 
-        startTimestamp = int(start.timestamp())
-        endTimestamp = int(end.timestamp())
-
         if startTimestamp == endTimestamp:
             endTimestamp += 1
         try:
@@ -136,39 +369,57 @@ class VideoCompressionJob(Job):
                     originalSize,
                     finalSize,
                     startTimestamp=startTimestamp,
-                    endTimestamp=endTimestamp
+                    endTimestamp=endTimestamp,
+                    crf=self.factor,
+                    qualityMetric=self.target.metric if self.target is not None else None,
+                    qualityScore=self.measuredQuality,
+                    codec=self.codec,
+                    preset=self.preset
                 )
             )
         except Exception as e:
             logging.error(e)
 
-    def save(self):
-        super().save()
+    def persist(self):
+        super().persist()
         
         dbInstance = db.getDbInstance()
 
         result = dbInstance.runGetQuery("SELECT * FROM VideoCompressionJob WHERE job=?", [self.baseData.uuid])
 
         if len(result) == 0:
-            dbInstance.runUpdateQuery("INSERT INTO VideoCompressionJob (job, originalFilePath, destinationFilePath,framerate,factor,quality) VALUES (?,?,?,?,?,?)", [
+            dbInstance.runUpdateQuery("INSERT INTO VideoCompressionJob (job, originalFilePath, destinationFilePath,framerate,factor,quality,artifacts,targetMetric,targetValue,measuredQuality,codec,presetFastest,presetSlowest,preset,chunked) VALUES (?,?,?,?,?,?,?,?,?,?,?,?,?,?,?)", [
                 self.baseData.uuid,
                 self.originalFilePath,
                 self.destinationFilePath,
                 self.framerate,
                 self.factor,
-                self.quality
+                self.quality,
+                ",".join(self.artifacts),
+                self.target.metric if self.target is not None else None,
+                self.target.value if self.target is not None else None,
+                self.measuredQuality,
+                self.codec,
+                self.presetRange[0] if self.presetRange is not None else None,
+                self.presetRange[1] if self.presetRange is not None else None,
+                self.preset,
+                self.chunked
             ])
 
             dbInstance.runUpdateQuery("UPDATE jobs SET state = ? WHERE uuid = ?", [self.baseData.state.name, self.baseData.uuid])
 
             return
         
-        dbInstance.runUpdateQuery("UPDATE VideoCompressionJob SET originalFilePath=?, destinationFilePath=?,framerate=?,factor=?,quality=? WHERE job = ?", [
+        dbInstance.runUpdateQuery("UPDATE VideoCompressionJob SET originalFilePath=?, destinationFilePath=?,framerate=?,factor=?,quality=?,artifacts=?,measuredQuality=?,preset=?,chunked=? WHERE job = ?", [
             self.originalFilePath,
             self.destinationFilePath,
             self.framerate,
             self.factor,
             self.quality,
+            ",".join(self.artifacts),
+            self.measuredQuality,
+            self.preset,
+            self.chunked,
             self.baseData.uuid
         ])
 
@@ -181,18 +432,116 @@ class VideoCompressionJob(Job):
         baseDict["framerate"] = self.framerate
         baseDict["quality"] = self.quality
         baseDict["factor"] = self.factor
+        baseDict["artifacts"] = self.artifacts
+        baseDict["targetQuality"] = {"metric": self.target.metric, "value": self.target.value} if self.target is not None else None
+        baseDict["measuredQuality"] = self.measuredQuality
+        baseDict["codec"] = self.codec
+        baseDict["preset"] = self.preset
+        baseDict["chunked"] = self.chunked
+        baseDict["presetRange"] = {"fastest": self.presetRange[0], "slowest": self.presetRange[1]} if self.presetRange is not None else None
+        baseDict["progress"] = self.progress
         return baseDict
 
     
 
 
 
+JOB_SELECT = """SELECT jobs.uuid,jobs.type,jobs.state,jobs.createdAt,jobs.expiresAt,
+    vcj.originalFilePath,vcj.destinationFilePath,vcj.framerate,vcj.factor,vcj.quality,jobs.owner,jobs.attempts,vcj.artifacts,
+    vcj.targetMetric,vcj.targetValue,vcj.measuredQuality,vcj.codec,vcj.presetFastest,vcj.presetSlowest,vcj.preset,vcj.chunked
+    FROM jobs LEFT JOIN VideoCompressionJob vcj ON vcj.job = jobs.uuid"""
+
+
+def jobFromRow(row: tuple) -> Job | None:
+    uuid = row[0]
+    type = JobType[row[1]]
+    state = JobState[row[2]] 
+    createdAt = datetime.fromisoformat(row[3]) if row[3] else None  
+    expiresAt = datetime.fromisoformat(row[4]) if row[4] else None
+    owner = row[10]
+    attempts = row[11]
+
+    if type not in [JobType.VIDEO_COMPRESSION_JOB]:
+        logging.warning(f"Cannot recover job of type '{type}'")
+        return None
+
+    if type == JobType.VIDEO_COMPRESSION_JOB:
+        if row[5] is None:
+            logging.warning(f"Cannot recover job of type '{JobType.VIDEO_COMPRESSION_JOB.value}', improper state!")
+            return None
+
+        originalFilePath = row[5]
+        destinationFilePath = row[6]
+        framerate = row[7]
+        factor = row[8]
+        quality = row[9]
+        artifacts = row[12].split(",") if row[12] else []
+        target = crf_search.QualityTarget(row[13], row[14]) if row[13] else None
+        measuredQuality = row[15]
+        codec = row[16] or codec_profiles.DEFAULT_CODEC
+        presetRange = (row[17], row[18]) if row[17] else None
+        preset = row[19]
+        isChunked = bool(row[20])
+
+        return VideoCompressionJob(
+            VideoCompressorJobData(
+                BaseJobData(uuid, state, type, createdAt, expiresAt, owner, attempts),
+                originalFilePath,
+                destinationFilePath,
+                quality,
+                factor,
+                framerate,
+                artifacts,
+                target,
+                measuredQuality,
+                codec,
+                presetRange,
+                preset,
+                isChunked
+            )
+        )
+
+
+@dataclass
+class Lease:
+    leaseId: str
+    job: Job
+    worker: str
+    expiresAt: float
+
+    def isExpired(self):
+        return time.monotonic() > self.expiresAt
+
+    def outputPartPath(self) -> str:
+        # Keyed by lease, a job leased again never appends to the upload of
+        # the worker that lost it
+        return scratch.getScratchSpace().pathFor(self.job.baseData.uuid, f"{self.leaseId}.part")
+
+
 class JobManager:
     
-    def __init__(self):
-        self.jobs: list[Job] = []
-        self.activeJob = None
+    def __init__(self, prefetchWindow: int = PREFETCH_WINDOW, slots: int = ENCODE_SLOTS):
+        self.window: deque[Job] = deque()
+        self.prefetchWindow = prefetchWindow
+        self.cursor: tuple[str, str] | None = None
+        self.activeJobs: dict[str, Job] = {}
+        self.futures: dict[str, supervisor.SupervisedTask] = {}
+        self.leases: dict[str, Lease] = {}
+        self.slotCount = slots
+        self.slots = threading.Semaphore(slots)
+        # Jobs still PENDING in the database, running ones included
+        self.pendingCount = 0
+        # Called with every job that leaves the queue for good
+        self.finishedListeners: list[Callable[[Job], None]] = []
+        # Leased jobs finish on the request thread, with no slots (remote
+        # workers only) the pool is just never used
+        self.finalizer = concurrent.futures.ThreadPoolExecutor(max_workers=max(1, slots), thread_name_prefix="finalize")
         self.emptyJobCondition = threading.Condition()
+        # Bumped whenever a job's persisted state changes, so clients can
+        # revalidate listings without re-reading them. The epoch keeps tags
+        # from a previous process from matching after a restart.
+        self.epoch = uuid.uuid4().hex[:8]
+        self.version = 0
 
 
     def runBlocking(self):
@@ -202,144 +551,421 @@ class JobManager:
         logging.info("Job Manager started working ...")
         
         while True: 
+            self.slots.acquire()
             job = self.getNextJob()   
-            self.activeJob = job
-            try:
-                job.run()
-                job.setCompleted()
-                job.setExpiresAt(datetime.now() + timedelta(days=2))
-            except Exception as e:
-                logging.error(f"Job failed -> {str(e)}")
+
+            if self.reserveScratch(job):
+                self.startJob(job)
+            else:
+                self.slots.release()
+
+    def reserveScratch(self, job: Job) -> bool:
+        """
+        Reserves the job's estimated output on scratch and on the files
+        volume. A job that doesn't fit right now is deferred and the next
+        one gets its turn, one that couldn't fit on empty volumes fails.
+        """
+        if not isinstance(job, VideoCompressionJob) or job.cancelRequested:
+            return True
+
+        scratchSpace = scratch.getScratchSpace()
+        folder = os.path.dirname(job.destinationFilePath)
+
+        try:
+            willChunk = supervisor.getSupervisor().submit(job.shouldChunk()).result()
+            sizeBytes = job.estimateScratchBytes(includeSource=willChunk)
+        except Exception as e:
+            self.completeJob(job, e)
+            return False
+
+        if scratchSpace.reserve(job.baseData.uuid, sizeBytes, folder) is not None:
+            return True
+
+        if not scratchSpace.fitsAtAll(sizeBytes, folder):
+            self.completeJob(job, Exception(f"Output estimated at {sizeBytes} bytes can never fit in scratch space"))
+            return False
+
+        logging.warning(f"Not enough space to reserve {sizeBytes} bytes for job {job.baseData.uuid}, retrying in {SCRATCH_RETRY_SECONDS}s")
+        with self.emptyJobCondition:
+            job.notBefore = time.monotonic() + SCRATCH_RETRY_SECONDS
+            self.activeJobs.pop(job.baseData.uuid, None)
+            self.window.append(job)
+
+        return False
+
+    def startJob(self, job: Job):
+        if not job.cancelRequested:
+            self.assignPreset(job)
+
+        with self.emptyJobCondition:
+            future = None
+            if not job.cancelRequested:
+                future = job.start()
+                self.futures[job.baseData.uuid] = future
+
+        if future is None:
+            self.finishJob(job, None)
+            return
+
+        # Done callbacks run on the supervisor loop, the database writes,
+        # scratch cleanup and listeners of finishJob must not
+        future.add_done_callback(lambda f: self.finalizer.submit(self.finishJob, job, f))
+
+    def finishJob(self, job: Job, future: concurrent.futures.Future | None):
+        try:
+            error = concurrent.futures.CancelledError() if future is None else future.exception()
+        except concurrent.futures.CancelledError as e:
+            error = e
+
+        self.completeJob(job, error)
+        self.slots.release()
+
+    def completeJob(self, job: Job, error: BaseException | None):
+        requeue = False
+        try:
+            if error is not None:
+                raise error
+
+            job.setCompleted()
+        except concurrent.futures.CancelledError:
+            logging.info(f"Job cancelled -> {job.baseData.uuid}")
+            job.setCancelled()
+        except supervisor.ProcessStalled as e:
+            if job.baseData.attempts < STALL_MAX_RETRIES:
+                logging.warning(f"Job stalled, requeueing -> {str(e)}")
+                job.baseData.attempts += 1
+                requeue = True
+            else:
+                logging.error(f"Job stalled too many times -> {str(e)}")
                 job.setFailed()
+        except Exception as e:
+            logging.error(f"Job failed -> {str(e)}")
+            job.setFailed()
+
+        finally:
+            with self.emptyJobCondition:
+                self.activeJobs.pop(job.baseData.uuid, None)
+                self.futures.pop(job.baseData.uuid, None)
+
+            # A requeued job resumes from what it left in scratch
+            scratch.getScratchSpace().release(job.baseData.uuid, removeFiles=not requeue)
+
+            if requeue:
+                self.pushJob(job, requeue=True)
+            else:
                 job.setExpiresAt(datetime.now() + timedelta(days=2))
+                job.save()
+                self.jobFinished(job)
+
+    def jobFinished(self, job: Job):
+        with self.emptyJobCondition:
+            self.pendingCount = max(0, self.pendingCount - 1)
+
+        for listener in self.finishedListeners:
+            try:
+                listener(job)
+            except Exception as e:
+                logging.error(f"Job finished listener failed: {e}")
+
+    def getParallelism(self):
+        with self.emptyJobCondition:
+            return max(1, self.slotCount + len(self.leases))
+
+    def estimateDrainSeconds(self) -> float:
+        estimates = job_statistics.getEncodeEstimates()
+        return self.pendingCount * estimates.averageCompressionSeconds / self.getParallelism()
+
+    def assignPreset(self, job: Job):
+        # The preset is fixed once chosen, a requeued job keeps the one its
+        # CRF search was measured with.
+        if not isinstance(job, VideoCompressionJob) or job.preset is not None:
+            return
+
+        try:
+            job.choosePreset(self.estimateDrainSeconds() / PRESET_PRESSURE_DRAIN_SECONDS)
+        except Exception as e:
+            logging.error(f"Unable to choose preset for job {job.baseData.uuid}: {e}")
+
+    def claimJob(self, worker: str) -> Lease | None:
+        # Remote workers pull from the same window as the local slots, the
+        # job stays active for as long as the worker keeps renewing it.
+        with self.emptyJobCondition:
+            if len(self.window) == 0:
+                self.refillWindow()
+
+            job = next((obj for obj in self.window if obj.isRemoteCapable()), None)
+
+            # The window may be full of jobs only this process can run
+            if job is None:
+                job = self.findRemoteJob()
+
+            if job is None:
+                return None
+
+            # The worker's upload lands in scratch
+            try:
+                sizeBytes = job.estimateScratchBytes()
+            except OSError:
+                sizeBytes = 0
+
+            if scratch.getScratchSpace().reserve(job.baseData.uuid, sizeBytes, os.path.dirname(job.destinationFilePath)) is None:
+                return None
+
+            if job in self.window:
+                self.window.remove(job)
+            lease = Lease(str(uuid.uuid4()), job, worker, time.monotonic() + LEASE_SECONDS)
+            self.activeJobs[job.baseData.uuid] = job
+            self.leases[lease.leaseId] = lease
+
+        self.assignPreset(job)
+
+        logging.info(f"Job {job.baseData.uuid} leased to worker '{worker}'")
+        return lease
+
+    def findRemoteJob(self) -> Job | None:
+        # Next PENDING job past the cursor that isRemoteCapable, the refill
+        # skips it later if it is still leased by then
+        dbInstance = db.getDbInstance()
+        clauses = [
+            "jobs.state = 'PENDING'",
+            "vcj.artifacts = ''",
+            "(vcj.targetMetric IS NULL OR vcj.measuredQuality IS NOT NULL)",
+            "vcj.chunked = 0",
+        ]
+        args = []
+
+        if self.cursor is not None:
+            clauses.append("(jobs.createdAt, jobs.uuid) > (?, ?)")
+            args.extend(self.cursor)
+
+        if len(self.activeJobs) > 0:
+            clauses.append(f"jobs.uuid NOT IN ({','.join('?' * len(self.activeJobs))})")
+            args.extend(self.activeJobs.keys())
+
+        rows = dbInstance.runGetQuery(f"{JOB_SELECT} WHERE {' AND '.join(clauses)} ORDER BY jobs.createdAt, jobs.uuid LIMIT 1", args)
+
+        return jobFromRow(rows[0]) if len(rows) == 1 else None
+
+    def getLease(self, leaseId: str) -> Lease | None:
+        with self.emptyJobCondition:
+            lease = self.leases.get(leaseId)
+
+        if lease is None or lease.isExpired():
+            return None
+
+        return lease
+
+    def renewLease(self, leaseId: str, progress: dict | None = None) -> Lease | None:
+        with self.emptyJobCondition:
+            lease = self.leases.get(leaseId)
+
+            if lease is None or lease.isExpired():
+                return None
+
+            lease.expiresAt = time.monotonic() + LEASE_SECONDS
+
+        if progress is not None and isinstance(lease.job, VideoCompressionJob):
+            lease.job.setProgress(progress)
 
-            finally:
+        return lease
+
+    def releaseLease(self, leaseId: str, error: BaseException | None) -> Lease | None:
+        with self.emptyJobCondition:
+            lease = self.leases.pop(leaseId, None)
+
+        if lease is None:
+            return None
+
+        self.completeJob(lease.job, error)
+        return lease
+
+    def reapLeases(self):
+        with self.emptyJobCondition:
+            expired = [lease for lease in self.leases.values() if lease.isExpired()]
+
+            for lease in expired:
+                del self.leases[lease.leaseId]
+                self.activeJobs.pop(lease.job.baseData.uuid, None)
+
+        for lease in expired:
+            logging.warning(f"Lease on job {lease.job.baseData.uuid} held by worker '{lease.worker}' expired, requeueing")
+            supervisor.removePaths([lease.outputPartPath()])
+            scratch.getScratchSpace().release(lease.job.baseData.uuid)
+            self.pushJob(lease.job, save=False, requeue=True)
+
+    def runLeaseReaper(self):
+        while True:
+            time.sleep(max(1, LEASE_SECONDS / 4))
+            self.reapLeases()
+
+    def cancelJob(self, uuid: str) -> Job | None:
+        # Pending jobs are cancelled in place. Running ones have their task
+        # cancelled, which kills the ffmpeg process group and lets finishJob
+        # record the CANCELLED state.
+        with self.emptyJobCondition:
+            job = self.activeJobs.get(uuid)
+
+            if job is None:
+                job = next((obj for obj in self.window if obj.baseData.uuid == uuid), None)
+                if job is not None:
+                    self.window.remove(job)
+                else:
+                    job = self.getJobById(uuid)
+
+                if job is None or job.baseData.state != JobState.PENDING:
+                    return job
+
+                job.setCancelled()
+                job.setExpiresAt(datetime.now() + timedelta(days=2))
                 job.save()
-                self.activeJob = None
+                future = None
+                lease = None
+            else:
+                job.cancelRequested = True
+                future = self.futures.get(uuid)
+                lease = next((obj for obj in self.leases.values() if obj.job is job), None)
+
+        if not job.cancelRequested:
+            self.jobFinished(job)
+            return job
+
+        if future is not None:
+            future.cancel()
+
+        if lease is not None:
+            self.releaseLease(lease.leaseId, concurrent.futures.CancelledError())
+
+        return job
+
+    def touch(self):
+        with self.emptyJobCondition:
+            self.version += 1
+
+    def getEtag(self, query: str, apikey: str):
+        # Distinct per query and client, a tag for one listing must not
+        # revalidate another
+        scope = hashlib.sha256(f"{query}\n{apikey}".encode()).hexdigest()[:16]
+        return f"{self.epoch}-{self.version}-{scope}"
 
     def getActiveJobList(self):
-        return list(map(lambda x: x.toDict(), [self.activeJob] + self.jobs if self.activeJob else self.jobs))
+        with self.emptyJobCondition:
+            jobs = list(self.activeJobs.values()) + list(self.window)
+
+        return list(map(lambda x: x.toDict(), jobs))
 
     def getNextJob(self):
         with self.emptyJobCondition:
-            while len(self.jobs) == 0:
-                logging.info("No jobs available, waiting for jobs ...")
-                self.emptyJobCondition.wait()
+            while True:
+                job = self.popReadyJob()
+
+                if job is None and len(self.window) < self.prefetchWindow:
+                    self.refillWindow()
+                    job = self.popReadyJob()
+
+                if job is not None:
+                    break
+
+                if len(self.window) == 0:
+                    logging.info("No jobs available, waiting for jobs ...")
+                    self.emptyJobCondition.wait()
+                else:
+                    # Only deferred jobs left, wait for the first to be due
+                    self.emptyJobCondition.wait(min(obj.notBefore for obj in self.window) - time.monotonic())
 
-            job = self.jobs.pop(0)
+            self.activeJobs[job.baseData.uuid] = job
             return job 
 
-    def pushJob(self, job: Job, save=True):
+    def popReadyJob(self) -> Job | None:
+        now = time.monotonic()
+        job = next((obj for obj in self.window if obj.notBefore <= now), None)
+
+        if job is not None:
+            self.window.remove(job)
+
+        return job
+
+    def refillWindow(self):
+        # Hydrates the next batch of pending jobs, in (createdAt, uuid) order,
+        # starting right after the last row we already handed out. Deferred
+        # jobs still in the window count against its size.
+        dbInstance = db.getDbInstance()
+        limit = self.prefetchWindow - len(self.window)
+
+        if self.cursor is None:
+            rows = dbInstance.runGetQuery(f"{JOB_SELECT} WHERE jobs.state = 'PENDING' ORDER BY jobs.createdAt, jobs.uuid LIMIT ?", [limit])
+        else:
+            rows = dbInstance.runGetQuery(f"{JOB_SELECT} WHERE jobs.state = 'PENDING' AND (jobs.createdAt, jobs.uuid) > (?, ?) ORDER BY jobs.createdAt, jobs.uuid LIMIT ?", [
+                self.cursor[0],
+                self.cursor[1],
+                limit
+            ])
+
+        for row in rows:
+            self.cursor = (row[3], row[0])
+            job = jobFromRow(row)
+
+            if job is not None and job.baseData.uuid not in self.activeJobs:
+                self.window.append(job)
+
+    def pushJob(self, job: Job, save=True, requeue=False):
         with self.emptyJobCondition:
             if save:
                 job.save()
 
-            self.jobs.append(job)
+            if not requeue:
+                self.pendingCount += 1
+
+            # A job created before the cursor would be skipped by the next
+            # refill, so it goes straight into the window instead.
+            if self.cursor is not None and (str(job.baseData.createdAt), job.baseData.uuid) <= self.cursor:
+                self.window.append(job)
+
+            self.version += 1
             logging.info("Job added: %s", job)
             self.emptyJobCondition.notify()
 
 
     def getJobById(self, uuid: str):
+        # Running jobs are served from memory, the database has no progress
+        with self.emptyJobCondition:
+            if uuid in self.activeJobs:
+                return self.activeJobs[uuid]
+
         dbInstance = db.getDbInstance()
 
-        result = dbInstance.runGetQuery("SELECT uuid,type,state,createdAt,expiresAt FROM jobs WHERE uuid = ?", [uuid])
+        result = dbInstance.runGetQuery(f"{JOB_SELECT} WHERE jobs.uuid = ?", [uuid])
 
         if len(result) != 1:
             return None
         
-        value = result[0]
-
-        uuid = value[0]
-        type = JobType[value[1]]
-        state = JobState[value[2]] 
-        createdAt = datetime.fromisoformat(value[3]) if value[3] else None  
-        expiresAt = datetime.fromisoformat(value[4]) if value[4] else None
-
-        if type not in [JobType.VIDEO_COMPRESSION_JOB]:
-            logging.warning(f"Cannot recover job of type '{type}'")
-            return None
-        
-
-        if type == JobType.VIDEO_COMPRESSION_JOB:
-                element = dbInstance.runGetQuery("SELECT job,originalFilePath,destinationFilePath,framerate,factor,quality FROM VideoCompressionJob WHERE job = ?", [uuid])
-                
-                if len(element) != 1:
-                    logging.warning(f"Cannot recover job of type '{JobType.VIDEO_COMPRESSION_JOB.value}', improper state!")
-                    return None
-
-                element = element[0]
-
-                originalFilePath = element[1]
-                destinationFilePath = element[2]
-                framerate = element[3]
-                factor = element[4]
-                quality = element[5]
-
-                vcjob = VideoCompressionJob(
-                    VideoCompressorJobData(
-                        BaseJobData(uuid, state, type, createdAt, expiresAt),
-                        originalFilePath,
-                        destinationFilePath,
-                        quality,
-                        factor,
-                        framerate
-                    )
-                )
-
-                return vcjob
+        return jobFromRow(result[0])
         
 
     def recoverStateFromDatabase(self):
         dbInstance = db.getDbInstance()
         
-        result = dbInstance.runGetQuery("SELECT uuid,type,state,createdAt,expiresAt FROM jobs WHERE state = 'PENDING'")
-        toBeRecovered = []
-        for row in result:
-            uuid = row[0]
-            type = JobType[row[1]]
-            state = JobState[row[2]] 
-            createdAt = datetime.fromisoformat(row[3]) if row[3] else None  
-            expiresAt = datetime.fromisoformat(row[4]) if row[4] else None
-
-            if type not in [JobType.VIDEO_COMPRESSION_JOB]:
-                logging.warning(f"Cannot recover job of type '{type}'")
-                continue
-
-            if type == JobType.VIDEO_COMPRESSION_JOB:
-                element = dbInstance.runGetQuery("SELECT job,originalFilePath,destinationFilePath,framerate,factor,quality FROM VideoCompressionJob WHERE job = ?", [uuid])
-
-                if len(element) != 1:
-                    logging.warning(f"Cannot recover job of type '{JobType.VIDEO_COMPRESSION_JOB.value}', improper state!")
-
-                element = element[0]
-
-                originalFilePath = element[1]
-                destinationFilePath = element[2]
-                framerate = element[3]
-                factor = element[4]
-                quality = element[5]
-
-                vcjob = VideoCompressionJob(
-                    VideoCompressorJobData(
-                        BaseJobData(uuid, state, type, createdAt, expiresAt),
-                        originalFilePath,
-                        destinationFilePath,
-                        quality,
-                        factor,
-                        framerate
-                    )
-                )
+        result = dbInstance.runGetQuery("SELECT COUNT(*) FROM jobs WHERE state = 'PENDING'")
+        pending = result[0][0] if len(result) == 1 else 0
+
+        with self.emptyJobCondition:
+            self.window.clear()
+            self.cursor = None
+            self.pendingCount = pending
+            self.emptyJobCondition.notify()
 
-                toBeRecovered.append(vcjob)
+        # Pending chunked jobs resume from their scratch workdirs
+        rows = dbInstance.runGetQuery("SELECT jobs.uuid FROM jobs JOIN VideoCompressionJob vcj ON vcj.job = jobs.uuid WHERE jobs.state = 'PENDING' AND vcj.chunked = 1")
+        freed = scratch.getScratchSpace().reclaim({row[0] for row in rows})
+        if freed > 0:
+            logging.info(f"Reclaimed {freed} bytes of scratch space left by a previous run")
 
-        for job in toBeRecovered:
-            self.pushJob(job, save=False)
+        logging.info(f"Recovered {pending} pending jobs, loading them in batches of {self.prefetchWindow}")
 
                 
     def getRelatedJobs(self, fname: str):
         dbInstance = db.getDbInstance()
 
-        query = dbInstance.runGetQuery("SELECT job FROM VideoCompressionJob WHERE originalFilePath=? OR destinationFilePath=?", [fname, fname])
+        query = dbInstance.runGetQuery("SELECT job FROM VideoCompressionJob WHERE originalFilePath=? OR destinationFilePath=? UNION SELECT job FROM VideoArtifact WHERE path=?", [fname, fname, fname])
         
         jobs = []
         
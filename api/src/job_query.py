@@ -0,0 +1,119 @@
+import base64
+import binascii
+from dataclasses import dataclass
+from datetime import datetime
+import db
+import job
+
+DEFAULT_PAGE_SIZE = 50
+MAX_PAGE_SIZE = 500
+
+JOB_FIELDS = [
+    "uuid",
+    "type",
+    "state",
+    "createdAt",
+    "expiresAt",
+    "originalFilePath",
+    "destinationFilePath",
+    "framerate",
+    "quality",
+    "factor",
+    "artifacts",
+    "targetQuality",
+    "measuredQuality",
+    "codec",
+    "preset",
+    "presetRange",
+    "chunked",
+]
+
+@dataclass
+class JobListFilter:
+    state: job.JobState | None = None
+    type: job.JobType | None = None
+    owner: str | None = None
+    createdAfter: datetime | None = None
+    createdBefore: datetime | None = None
+
+
+@dataclass
+class JobPage:
+    jobs: list[job.Job]
+    nextCursor: str | None
+
+
+def encodeCursor(createdAt: str, uuid: str) -> str:
+    raw = f"{createdAt}|{uuid}".encode()
+    return base64.urlsafe_b64encode(raw).decode()
+
+def decodeCursor(cursor: str) -> tuple[str, str]:
+    try:
+        raw = base64.urlsafe_b64decode(cursor.encode()).decode()
+    except (binascii.Error, UnicodeDecodeError):
+        raise ValueError("Invalid cursor")
+
+    split = raw.split("|")
+
+    if len(split) != 2 or len(split[1]) == 0:
+        raise ValueError("Invalid cursor")
+
+    # Raises ValueError as well if the timestamp was tampered with
+    datetime.fromisoformat(split[0])
+
+    return split[0], split[1]
+
+
+def listJobs(filter: JobListFilter, cursor: str | None = None, limit: int = DEFAULT_PAGE_SIZE) -> JobPage:
+    # Keyset pagination, newest first. Every filter maps onto one of the
+    # (column, createdAt, uuid) indexes so a page costs one index range scan
+    # no matter how deep into the listing the client is.
+    clauses = []
+    args = []
+
+    if filter.state is not None:
+        clauses.append("jobs.state = ?")
+        args.append(filter.state.name)
+
+    if filter.type is not None:
+        clauses.append("jobs.type = ?")
+        args.append(filter.type.name)
+
+    if filter.owner is not None:
+        clauses.append("jobs.owner = ?")
+        args.append(filter.owner)
+
+    if filter.createdAfter is not None:
+        clauses.append("jobs.createdAt >= ?")
+        args.append(filter.createdAfter)
+
+    if filter.createdBefore is not None:
+        clauses.append("jobs.createdAt < ?")
+        args.append(filter.createdBefore)
+
+    if cursor is not None:
+        createdAt, uuid = decodeCursor(cursor)
+        clauses.append("(jobs.createdAt, jobs.uuid) < (?, ?)")
+        args.extend([createdAt, uuid])
+
+    where = f" WHERE {' AND '.join(clauses)}" if clauses else ""
+
+    dbInstance = db.getDbInstance()
+    rows = dbInstance.runGetQuery(f"{job.JOB_SELECT}{where} ORDER BY jobs.createdAt DESC, jobs.uuid DESC LIMIT ?", args + [limit + 1])
+
+    nextCursor = None
+    if len(rows) > limit:
+        rows = rows[:limit]
+        nextCursor = encodeCursor(rows[-1][3], rows[-1][0])
+
+    jobs = [obj for obj in map(job.jobFromRow, rows) if obj is not None]
+
+    return JobPage(jobs, nextCursor)
+
+
+def selectFields(values: dict, fields: list[str] | None) -> dict:
+    # progress only lives in memory, listed jobs come from the database
+    if fields is None:
+        fields = JOB_FIELDS
+
+    return {key: values[key] for key in fields if key in values}
@@ -1,6 +1,15 @@
 from dataclasses import dataclass, asdict
+import os
+import time
+import codec_profiles
 import db
 
+# Used until enough jobs have finished to measure real throughput
+DEFAULT_ENCODE_BYTES_PER_SECOND = float(os.environ.get("DEFAULT_ENCODE_BYTES_PER_SECOND", str(2 * 1024 * 1024)))
+DEFAULT_COMPRESSION_SECONDS = float(os.environ.get("DEFAULT_COMPRESSION_SECONDS", "120"))
+DEFAULT_OUTPUT_SIZE_RATIO = 1.0
+ESTIMATE_CACHE_SECONDS = 60
+
 @dataclass
 class VideoCompressionStatistics:
     vcj: str
@@ -8,6 +17,11 @@ class VideoCompressionStatistics:
     finalSizeBytes: int
     startTimestamp: int
     endTimestamp: int
+    crf: int | None = None
+    qualityMetric: str | None = None
+    qualityScore: float | None = None
+    codec: str | None = None
+    preset: str | None = None
 
 
 @dataclass
@@ -28,15 +42,92 @@ class VideoCompressionStatisticsReport:
 def saveVideoCompressionStatistics(statistics: VideoCompressionStatistics):
     dbInstance = db.getDbInstance()
 
-    dbInstance.runUpdateQuery("INSERT INTO VideoCompressionStatistics (vcj, originalSizeBytes, finalSizeBytes, startTimestamp, endTimestamp) VALUES (?,?,?,?,?)", [
+    dbInstance.runUpdateQuery("INSERT INTO VideoCompressionStatistics (vcj, originalSizeBytes, finalSizeBytes, startTimestamp, endTimestamp, crf, qualityMetric, qualityScore, codec, preset) VALUES (?,?,?,?,?,?,?,?,?,?)", [
         statistics.vcj,
         statistics.originalSizeBytes,
         statistics.finalSizeBytes,
         statistics.startTimestamp,
-        statistics.endTimestamp
+        statistics.endTimestamp,
+        statistics.crf,
+        statistics.qualityMetric,
+        statistics.qualityScore,
+        statistics.codec,
+        statistics.preset
     ])
 
 
+@dataclass
+class EncodeEstimates:
+    sourceBytesPerSecond: float
+    averageCompressionSeconds: float
+    outputSizeRatio: float
+    measuredAt: float
+
+_estimates = None
+
+def getEncodeEstimates() -> EncodeEstimates:
+    # Aggregates over the whole statistics table, so they are cached rather
+    # than recomputed on every admission check.
+    global _estimates
+    if _estimates is not None and time.monotonic() - _estimates.measuredAt < ESTIMATE_CACHE_SECONDS:
+        return _estimates
+
+    dbInstance = db.getDbInstance()
+    result = dbInstance.runGetQuery("SELECT SUM(originalSizeBytes), SUM(endTimestamp - startTimestamp), AVG(endTimestamp - startTimestamp), SUM(finalSizeBytes) FROM VideoCompressionStatistics")
+
+    sourceBytesPerSecond = DEFAULT_ENCODE_BYTES_PER_SECOND
+    averageCompressionSeconds = DEFAULT_COMPRESSION_SECONDS
+    outputSizeRatio = DEFAULT_OUTPUT_SIZE_RATIO
+
+    if len(result) == 1 and result[0][0] and result[0][1]:
+        sourceBytesPerSecond = result[0][0] / result[0][1]
+        averageCompressionSeconds = result[0][2]
+        outputSizeRatio = result[0][3] / result[0][0]
+
+    _estimates = EncodeEstimates(sourceBytesPerSecond, averageCompressionSeconds, outputSizeRatio, time.monotonic())
+    return _estimates
+
+def estimateEncodeSeconds(sourceSizeBytes: int) -> float:
+    return sourceSizeBytes / getEncodeEstimates().sourceBytesPerSecond
+
+def estimateOutputBytes(sourceSizeBytes: int) -> int:
+    return int(sourceSizeBytes * getEncodeEstimates().outputSizeRatio)
+
+
+def getPresetMeasurements() -> list[codec_profiles.PresetMeasurement]:
+    dbInstance = db.getDbInstance()
+
+    # Rows from before codecs were recorded were all x264 at its default preset
+    rows = dbInstance.runGetQuery(f"""
+        SELECT
+        COALESCE(codec, '{codec_profiles.DEFAULT_CODEC}'),
+        COALESCE(preset, '{codec_profiles.PROFILES[codec_profiles.DEFAULT_CODEC].defaultPreset}'),
+        1.0 * SUM(originalSizeBytes) / SUM(endTimestamp - startTimestamp),
+        1.0 * SUM(finalSizeBytes) / SUM(originalSizeBytes),
+        COUNT(*)
+        FROM VideoCompressionStatistics
+        WHERE endTimestamp > startTimestamp AND originalSizeBytes > 0
+        GROUP BY 1, 2
+    """)
+
+    return [codec_profiles.PresetMeasurement(row[0], row[1], row[2], row[3], row[4]) for row in rows]
+
+_costModel = None
+_costModelMeasuredAt = 0.0
+
+def getCostModel() -> codec_profiles.CostModel:
+    global _costModel, _costModelMeasuredAt
+    if _costModel is not None and time.monotonic() - _costModelMeasuredAt < ESTIMATE_CACHE_SECONDS:
+        return _costModel
+
+    model = codec_profiles.CostModel()
+    model.calibrate(getPresetMeasurements())
+
+    _costModel = model
+    _costModelMeasuredAt = time.monotonic()
+    return _costModel
+
+
 def generateVideoCompressionStatisticsDict() -> dict:
     return asdict(generateVideoCompressionStatistics())
 
@@ -0,0 +1,180 @@
+import errno
+import logging
+import os
+import shutil
+import tempfile
+import threading
+from dataclasses import dataclass
+
+# Encodes write here and outputs are only moved into the served folder
+# once complete. Point it at fast local storage (tmpfs, NVMe).
+SCRATCH_FOLDER = os.environ.get("SCRATCH_FOLDER", "/scratch")
+# Free bytes every volume keeps after all reservations
+SCRATCH_HEADROOM_BYTES = int(os.environ.get("SCRATCH_HEADROOM_BYTES", str(1024 * 1024 * 1024)))
+# Reserved output size on top of the estimate
+SCRATCH_RESERVE_MARGIN = float(os.environ.get("SCRATCH_RESERVE_MARGIN", "1.5"))
+
+
+@dataclass
+class Reservation:
+    jobId: str
+    sizeBytes: int
+    devices: list[int]
+
+
+def fsyncPath(path: str):
+    fd = os.open(path, os.O_RDONLY)
+    try:
+        os.fsync(fd)
+    finally:
+        os.close(fd)
+
+
+def folderSize(path: str) -> int:
+    size = 0
+    for root, _, files in os.walk(path):
+        size += sum(os.path.getsize(os.path.join(root, name)) for name in files)
+
+    return size
+
+
+def publish(source: str, destination: str):
+    """
+    Moves a finished file into place so that readers see either nothing or
+    the whole file. Data is flushed before the rename and the rename is
+    flushed after it, a crash in between leaves no partial destination.
+    """
+    fsyncPath(source)
+    destinationFolder = os.path.dirname(destination)
+
+    try:
+        os.replace(source, destination)
+    except OSError as e:
+        # Separate mounts can share a st_dev, so only the rename itself
+        # tells whether it can cross. If not, copy next to the destination.
+        if e.errno != errno.EXDEV:
+            raise
+
+        # The temporary name can't be guessed by clients of the served
+        # folder, and is removed if the copy fails (e.g. ENOSPC)
+        fd, partPath = tempfile.mkstemp(prefix=".publish-", dir=destinationFolder)
+        os.close(fd)
+        try:
+            shutil.copyfile(source, partPath)
+            # mkstemp creates it owner-only
+            shutil.copymode(source, partPath)
+            fsyncPath(partPath)
+            os.replace(partPath, destination)
+        except BaseException:
+            os.remove(partPath)
+            raise
+
+        os.remove(source)
+
+    fsyncPath(destinationFolder)
+
+
+class ScratchSpace:
+    def __init__(self, folder: str = SCRATCH_FOLDER, headroomBytes: int = SCRATCH_HEADROOM_BYTES):
+        self.folder = folder
+        self.headroomBytes = headroomBytes
+        self.lock = threading.Lock()
+        self.reservations: dict[str, Reservation] = {}
+        # Reserved bytes per st_dev, so scratch and destination on the same
+        # volume are only counted once
+        self.reserved: dict[int, int] = {}
+
+    def workdir(self, jobId: str) -> str:
+        return os.path.join(self.folder, jobId)
+
+    def pathFor(self, jobId: str, destination: str) -> str:
+        workdir = self.workdir(jobId)
+        os.makedirs(workdir, exist_ok=True)
+        return os.path.join(workdir, os.path.basename(destination))
+
+    def reserve(self, jobId: str, sizeBytes: int, destinationFolder: str) -> Reservation | None:
+        """
+        Reserves sizeBytes on the scratch volume and on the destination
+        volume. Returns None when either would drop below the headroom, the
+        job should be deferred until running encodes release their space.
+        Reserving again for the same job returns the existing reservation.
+        """
+        os.makedirs(self.folder, exist_ok=True)
+        paths = {os.stat(path).st_dev: path for path in [self.folder, destinationFolder]}
+
+        with self.lock:
+            if jobId in self.reservations:
+                return self.reservations[jobId]
+
+            for device, path in paths.items():
+                free = shutil.disk_usage(path).free - self.reserved.get(device, 0)
+                if free - sizeBytes < self.headroomBytes:
+                    return None
+
+            reservation = Reservation(jobId, sizeBytes, list(paths))
+            self.reservations[jobId] = reservation
+            for device in reservation.devices:
+                self.reserved[device] = self.reserved.get(device, 0) + sizeBytes
+
+        return reservation
+
+    def usedBytes(self, jobId: str) -> int:
+        # What the job already has in scratch, e.g. chunks it resumes from
+        return folderSize(self.workdir(jobId))
+
+    def fitsAtAll(self, sizeBytes: int, destinationFolder: str) -> bool:
+        # Whether an empty volume could take the reservation
+        os.makedirs(self.folder, exist_ok=True)
+        return all(shutil.disk_usage(path).total - sizeBytes >= self.headroomBytes for path in [self.folder, destinationFolder])
+
+    def release(self, jobId: str, removeFiles: bool = True):
+        """
+        Drops the job's reservation and, unless the job will resume from
+        them, whatever it left in scratch.
+        """
+        with self.lock:
+            reservation = self.reservations.pop(jobId, None)
+
+            if reservation is not None:
+                for device in reservation.devices:
+                    self.reserved[device] = max(0, self.reserved.get(device, 0) - reservation.sizeBytes)
+
+        if removeFiles:
+            shutil.rmtree(self.workdir(jobId), ignore_errors=True)
+
+    def reclaim(self, keep: set[str] = set()) -> int:
+        """
+        Removes everything under the scratch folder except the workdirs of
+        the jobs in keep. Only safe before any encode has started, i.e. at
+        startup, when whatever is there was left behind by a previous
+        process. Returns the number of bytes freed.
+        """
+        if not os.path.isdir(self.folder):
+            return 0
+
+        freed = 0
+        for entry in os.scandir(self.folder):
+            if entry.name in keep:
+                continue
+
+            try:
+                if entry.is_dir(follow_symlinks=False):
+                    freed += folderSize(entry.path)
+                    shutil.rmtree(entry.path)
+                else:
+                    freed += entry.stat(follow_symlinks=False).st_size
+                    os.remove(entry.path)
+            except OSError as e:
+                logging.error(f"Unable to reclaim '{entry.path}': {e}")
+
+        return freed
+
+
+_instance = None
+
+def getScratchSpace() -> ScratchSpace:
+    global _instance
+    if _instance is None:
+        _instance = ScratchSpace()
+
+    return _instance
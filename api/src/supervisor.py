@@ -0,0 +1,237 @@
+import asyncio
+import concurrent.futures
+import logging
+import os
+import signal
+import threading
+import time
+from collections import deque
+from dataclasses import dataclass
+from typing import Callable
+
+STDERR_TAIL_LINES = 50
+STDERR_LINE_LIMIT = 1024
+WATCHDOG_INTERVAL = 1.0
+
+
+class ProcessError(Exception):
+    def __init__(self, message: str, stderrTail: list[str]):
+        super().__init__(message)
+        self.stderrTail = stderrTail
+
+class ProcessTimeout(ProcessError):
+    pass
+
+class ProcessStalled(ProcessError):
+    pass
+
+
+@dataclass
+class ProcessLimits:
+    wallTimeout: float | None = None
+    noProgressTimeout: float | None = None
+
+
+@dataclass
+class ProcessResult:
+    returncode: int
+    stderrTail: list[str]
+    # Last value of every key=value line seen on stdout
+    stdoutValues: dict[str, str]
+
+
+class ProgressTracker:
+    # Fed with the key=value lines ffmpeg writes for '-progress pipe:1'.
+    # Only an advancing out_time_us or frame counts as progress, so a process
+    # that keeps logging while stuck still trips the no-progress timeout.
+    def __init__(self, onProgress: Callable[[dict], None] | None = None):
+        self.onProgress = onProgress
+        self.lastProgressAt = time.monotonic()
+        self.values: dict[str, str] = {}
+        self.outTimeUs = -1
+        self.frame = -1
+
+    def feed(self, line: str):
+        key, sep, value = line.partition("=")
+        if not sep:
+            return
+
+        self.values[key.strip()] = value.strip()
+
+        if key.strip() != "progress":
+            return
+
+        outTimeUs = parseInt(self.values.get("out_time_us"))
+        frame = parseInt(self.values.get("frame"))
+
+        if outTimeUs > self.outTimeUs or frame > self.frame:
+            self.outTimeUs = max(outTimeUs, self.outTimeUs)
+            self.frame = max(frame, self.frame)
+            self.markProgress()
+
+            if self.onProgress is not None:
+                try:
+                    self.onProgress(dict(self.values))
+                except Exception as e:
+                    logging.error(f"Progress callback failed: {e}")
+
+    def markProgress(self):
+        self.lastProgressAt = time.monotonic()
+
+
+def parseInt(value: str | None) -> int:
+    try:
+        return int(value)
+    except (TypeError, ValueError):
+        return -1
+
+
+def killProcessGroup(process: asyncio.subprocess.Process):
+    try:
+        os.killpg(process.pid, signal.SIGKILL)
+    except (ProcessLookupError, PermissionError):
+        pass
+
+
+def removePaths(paths: list[str]):
+    for path in paths:
+        try:
+            os.remove(path)
+        except FileNotFoundError:
+            pass
+        except OSError as e:
+            logging.error(f"Unable to remove '{path}': {e}")
+
+
+async def readStderr(stream: asyncio.StreamReader, tail: deque):
+    while True:
+        line = await stream.readline()
+        if not line:
+            return
+
+        tail.append(line[:STDERR_LINE_LIMIT].decode(errors="replace").rstrip())
+
+
+async def readProgress(stream: asyncio.StreamReader, tracker: ProgressTracker):
+    while True:
+        line = await stream.readline()
+        if not line:
+            return
+
+        tracker.feed(line.decode(errors="replace"))
+
+
+async def runProcess(argv: list[str], limits: ProcessLimits = ProcessLimits(), onProgress: Callable[[dict], None] | None = None, cleanupPaths: list[str] = []) -> ProcessResult:
+    """
+    Runs argv without a shell in its own process group. stdout is parsed as
+    ffmpeg '-progress' output and only the last STDERR_TAIL_LINES lines of
+    stderr are kept. On timeout, stall or cancellation the whole group is
+    killed and cleanupPaths are removed.
+    """
+    process = await asyncio.create_subprocess_exec(
+        *argv,
+        stdin=asyncio.subprocess.DEVNULL,
+        stdout=asyncio.subprocess.PIPE,
+        stderr=asyncio.subprocess.PIPE,
+        start_new_session=True
+    )
+
+    stderrTail = deque(maxlen=STDERR_TAIL_LINES)
+    tracker = ProgressTracker(onProgress)
+    startedAt = time.monotonic()
+
+    done = asyncio.ensure_future(asyncio.gather(
+        readStderr(process.stderr, stderrTail),
+        readProgress(process.stdout, tracker),
+        process.wait()
+    ))
+
+    try:
+        while True:
+            finished, _ = await asyncio.wait({done}, timeout=WATCHDOG_INTERVAL)
+            if finished:
+                break
+
+            now = time.monotonic()
+
+            if limits.wallTimeout is not None and now - startedAt > limits.wallTimeout:
+                raise ProcessTimeout(f"Process exceeded wall-clock timeout of {limits.wallTimeout}s", list(stderrTail))
+
+            if limits.noProgressTimeout is not None and now - tracker.lastProgressAt > limits.noProgressTimeout:
+                raise ProcessStalled(f"Process made no progress for {limits.noProgressTimeout}s", list(stderrTail))
+
+        done.result()
+
+    except BaseException:
+        killProcessGroup(process)
+        done.cancel()
+        await asyncio.wait({done})
+        if not done.cancelled():
+            done.exception()
+        await process.wait()
+        removePaths(cleanupPaths)
+        raise
+
+    return ProcessResult(process.returncode, list(stderrTail), dict(tracker.values))
+
+
+class SupervisedTask:
+    # Handle on a coroutine running on the supervisor loop. Cancelling goes
+    # to the asyncio task, and the future only resolves once that task has
+    # really finished, i.e. after runProcess killed and reaped its process
+    # group, so done callbacks never run with the process still alive.
+    def __init__(self, loop: asyncio.AbstractEventLoop, coroutine):
+        self.loop = loop
+        self.future = concurrent.futures.Future()
+        self.task: asyncio.Task | None = None
+        loop.call_soon_threadsafe(self._start, coroutine)
+
+    def _start(self, coroutine):
+        self.task = self.loop.create_task(coroutine)
+        self.task.add_done_callback(self._finished)
+
+    def _finished(self, task: asyncio.Task):
+        if task.cancelled():
+            self.future.cancel()
+        elif task.exception() is not None:
+            self.future.set_exception(task.exception())
+        else:
+            self.future.set_result(task.result())
+
+    def cancel(self):
+        # Queued after _start, so the task always exists by the time it runs
+        self.loop.call_soon_threadsafe(lambda: self.task.cancel())
+
+    def add_done_callback(self, callback: Callable[[concurrent.futures.Future], None]):
+        self.future.add_done_callback(callback)
+
+    def result(self, timeout: float | None = None):
+        return self.future.result(timeout)
+
+
+class Supervisor:
+    # Owns one event loop thread on which every supervised process runs, so
+    # concurrent encodes cost a few coroutines instead of a thread each.
+    def __init__(self):
+        self.loop = asyncio.new_event_loop()
+        self.thread = threading.Thread(target=self._runLoop, name="supervisor", daemon=True)
+        self.thread.start()
+
+    def _runLoop(self):
+        asyncio.set_event_loop(self.loop)
+        self.loop.run_forever()
+
+    def submit(self, coroutine) -> SupervisedTask:
+        return SupervisedTask(self.loop, coroutine)
+
+
+_instance = None
+_instanceLock = threading.Lock()
+
+def getSupervisor() -> Supervisor:
+    global _instance
+    with _instanceLock:
+        if _instance is None:
+            _instance = Supervisor()
+
+    return _instance
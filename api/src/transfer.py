@@ -0,0 +1,71 @@
+import os
+import re
+from dataclasses import dataclass
+
+CHUNK_SIZE = 1024 * 1024
+
+CONTENT_RANGE = re.compile(r"^bytes (\d+)-(\d+)/(\d+)$")
+
+
+@dataclass
+class ContentRange:
+    start: int
+    end: int
+    total: int
+
+    def length(self):
+        return self.end - self.start + 1
+
+
+def parseContentRange(header: str | None) -> ContentRange | None:
+    if header is None:
+        return None
+
+    match = CONTENT_RANGE.match(header.strip())
+
+    if match is None:
+        return None
+
+    contentRange = ContentRange(int(match.group(1)), int(match.group(2)), int(match.group(3)))
+
+    if contentRange.start > contentRange.end or contentRange.end >= contentRange.total:
+        return None
+
+    return contentRange
+
+def formatContentRange(start: int, length: int, total: int) -> str:
+    return f"bytes {start}-{start + length - 1}/{total}"
+
+
+def receivedBytes(path: str) -> int:
+    try:
+        return os.path.getsize(path)
+    except FileNotFoundError:
+        return 0
+
+def appendRange(path: str, stream, contentRange: ContentRange) -> int:
+    """
+    Appends one uploaded range to path, copying CHUNK_SIZE bytes at a time.
+    Ranges must arrive in order, a range starting anywhere but at the
+    current end of the file raises ValueError so the client can resume from
+    receivedBytes(path). Returns the new size of the file.
+    """
+    if contentRange.start != receivedBytes(path):
+        raise ValueError(f"Expected range starting at {receivedBytes(path)}")
+
+    remaining = contentRange.length()
+
+    with open(path, "ab") as f:
+        while remaining > 0:
+            chunk = stream.read(min(CHUNK_SIZE, remaining))
+            if not chunk:
+                break
+
+            f.write(chunk)
+            remaining -= len(chunk)
+
+    if remaining > 0:
+        # Whatever arrived is kept, the client resumes from receivedBytes(path)
+        raise ValueError("Range body shorter than its Content-Range")
+
+    return receivedBytes(path)
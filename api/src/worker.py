@@ -0,0 +1,231 @@
+"""
+Standalone encode worker. Pulls jobs from an API instance, encodes them
+locally and uploads the result:
+
+    python3 src/worker.py --api http://localhost:5000 --key <workerkey> --workdir /tmp/worker-1
+
+The key must be one of the API's WORKER_API_KEYS, client keys are
+rejected. Several workers can run against the same API, by default each
+gets its own workdir under /tmp named after --name.
+"""
+import argparse
+import asyncio
+import json
+import logging
+import os
+import shutil
+import socket
+import time
+import urllib.error
+import urllib.parse
+import urllib.request
+from datetime import datetime
+import ffmpeg
+import transfer
+
+UPLOAD_CHUNK_SIZE = 8 * 1024 * 1024
+
+
+class LeaseLost(Exception):
+    pass
+
+
+class ApiClient:
+    def __init__(self, api: str, apikey: str):
+        self.api = api.rstrip("/")
+        self.apikey = apikey
+
+    def url(self, path: str, leaseId: str | None = None):
+        query = f"?{urllib.parse.urlencode({'lease': leaseId})}" if leaseId is not None else ""
+        return f"{self.api}{path}{query}"
+
+    def open(self, method: str, url: str, body: bytes | None = None, headers: dict = {}):
+        request = urllib.request.Request(url, data=body, method=method, headers={"X-API-Key": self.apikey, **headers})
+
+        try:
+            return urllib.request.urlopen(request)
+        except urllib.error.HTTPError as e:
+            if e.code == 410:
+                raise LeaseLost(url)
+            raise
+
+    def call(self, method: str, path: str, payload: dict | None = None, leaseId: str | None = None, body: bytes | None = None, headers: dict = {}):
+        if payload is not None:
+            body = json.dumps(payload).encode()
+            headers = {**headers, "Content-Type": "application/json"}
+
+        with self.open(method, self.url(path, leaseId), body, headers) as response:
+            content = response.read()
+            return json.loads(content) if content else None
+
+    def lease(self, worker: str) -> dict | None:
+        return self.call("POST", "/worker/lease", {"worker": worker})
+
+    def heartbeat(self, leaseId: str, progress: dict | None):
+        return self.call("POST", "/worker/heartbeat", {"leaseId": leaseId, "progress": progress})
+
+    def download(self, leaseId: str, path: str):
+        # Resumes a partial download with a Range request
+        offset = transfer.receivedBytes(path)
+        headers = {"Range": f"bytes={offset}-"} if offset > 0 else {}
+
+        try:
+            response = self.open("GET", self.url("/worker/input", leaseId), headers=headers)
+        except urllib.error.HTTPError as e:
+            if e.code == 416:
+                return
+            raise
+
+        with response:
+            mode = "ab" if response.status == 206 else "wb"
+            with open(path, mode) as f:
+                shutil.copyfileobj(response, f, transfer.CHUNK_SIZE)
+
+    def upload(self, leaseId: str, path: str):
+        total = os.path.getsize(path)
+        offset = self.call("GET", "/worker/output", leaseId=leaseId)["received"]
+
+        with open(path, "rb") as f:
+            f.seek(offset)
+            while offset < total:
+                chunk = f.read(UPLOAD_CHUNK_SIZE)
+                headers = {"Content-Range": transfer.formatContentRange(offset, len(chunk), total), "Content-Type": "application/octet-stream"}
+                offset = self.call("PUT", "/worker/output", leaseId=leaseId, body=chunk, headers=headers)["received"]
+                f.seek(offset)
+
+        return total
+
+    def complete(self, leaseId: str, sizeBytes: int, startTimestamp: int, endTimestamp: int):
+        return self.call("POST", "/worker/complete", {
+            "leaseId": leaseId,
+            "sizeBytes": sizeBytes,
+            "startTimestamp": startTimestamp,
+            "endTimestamp": endTimestamp
+        })
+
+    def fail(self, leaseId: str, error: str):
+        return self.call("POST", "/worker/fail", {"leaseId": leaseId, "error": error})
+
+
+class LeaseRunner:
+    def __init__(self, client: ApiClient, lease: dict, workdir: str):
+        self.client = client
+        self.lease = lease
+        self.leaseId = lease["leaseId"]
+        self.job = lease["job"]
+        self.progress: dict | None = None
+        # Extensions are kept, ffmpeg picks the muxer and audio handling from them
+        inputExtension = os.path.splitext(self.job["originalFilePath"])[1]
+        outputExtension = os.path.splitext(self.job["destinationFilePath"])[1]
+        # Keyed by lease, a job re-leased to another worker sharing the
+        # workdir never has its files removed by the one that lost it
+        self.inputPath = os.path.join(workdir, f"{self.leaseId}.input{inputExtension}")
+        self.outputPath = os.path.join(workdir, f"{self.leaseId}.output{outputExtension}")
+
+    async def keepAlive(self, work: asyncio.Task):
+        interval = max(1, self.lease["leaseSeconds"] / 3)
+        while not work.done():
+            await asyncio.sleep(interval)
+            try:
+                await asyncio.to_thread(self.client.heartbeat, self.leaseId, self.progress)
+            except LeaseLost:
+                logging.warning(f"Lease on job {self.job['uuid']} lost, aborting")
+                work.cancel()
+                return
+            except Exception as e:
+                logging.error(f"Heartbeat failed: {e}")
+
+    def onProgress(self, values: dict):
+        self.progress = values
+
+    async def work(self):
+        await asyncio.to_thread(self.client.download, self.leaseId, self.inputPath)
+
+        config = ffmpeg.CompressVideoConfig(
+            self.outputPath,
+            self.inputPath,
+            self.job["factor"],
+            self.job["framerate"],
+            self.job["quality"],
+            codec=self.job["codec"],
+            preset=self.job["preset"]
+        )
+
+        start = datetime.now()
+        await ffmpeg.compressVideo(config, onProgress=self.onProgress)
+        end = datetime.now()
+
+        sizeBytes = await asyncio.to_thread(self.client.upload, self.leaseId, self.outputPath)
+        await asyncio.to_thread(self.client.complete, self.leaseId, sizeBytes, int(start.timestamp()), int(end.timestamp()))
+
+    async def run(self):
+        work = asyncio.ensure_future(self.work())
+        keepAlive = asyncio.ensure_future(self.keepAlive(work))
+
+        try:
+            await work
+        except asyncio.CancelledError:
+            raise LeaseLost(self.leaseId)
+        finally:
+            keepAlive.cancel()
+
+    def cleanup(self):
+        for path in [self.inputPath, self.outputPath]:
+            try:
+                os.remove(path)
+            except FileNotFoundError:
+                pass
+
+
+def runWorker(client: ApiClient, name: str, workdir: str, pollInterval: float):
+    os.makedirs(workdir, exist_ok=True)
+    logging.info(f"Worker '{name}' started, polling {client.api}")
+
+    while True:
+        try:
+            lease = client.lease(name)
+        except Exception as e:
+            logging.error(f"Unable to lease job: {e}")
+            lease = None
+
+        if lease is None:
+            time.sleep(pollInterval)
+            continue
+
+        runner = LeaseRunner(client, lease, workdir)
+        logging.info(f"Running job {runner.job['uuid']}")
+
+        try:
+            asyncio.run(runner.run())
+        except LeaseLost:
+            pass
+        except Exception as e:
+            logging.error(f"Job failed -> {str(e)}")
+            try:
+                client.fail(runner.leaseId, str(e))
+            except Exception as e:
+                logging.error(f"Unable to report failure: {e}")
+        finally:
+            runner.cleanup()
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Remote video compression worker")
+    parser.add_argument("--api", required=True, help="Base URL of the API, e.g. http://localhost:5000")
+    parser.add_argument("--key", default=os.environ.get("WORKER_API_KEY"), help="Worker key, defaults to $WORKER_API_KEY")
+    parser.add_argument("--name", default=f"{socket.gethostname()}-{os.getpid()}")
+    parser.add_argument("--workdir", help="Defaults to /tmp/ffmpeg-worker-<name>")
+    parser.add_argument("--poll-interval", type=float, default=5.0)
+    args = parser.parse_args()
+
+    if not args.key:
+        parser.error("a worker key is required, pass --key or set WORKER_API_KEY")
+
+    workdir = args.workdir or os.path.join("/tmp", f"ffmpeg-worker-{args.name}")
+
+    logging.basicConfig(level=logging.INFO, format='%(asctime)s: %(levelname)s: %(message)s')
+    runWorker(ApiClient(args.api, args.key), args.name, workdir, args.poll_interval)
+
+
+if __name__ == '__main__':
+    main()
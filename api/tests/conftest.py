@@ -0,0 +1,82 @@
+import os
+import sys
+from datetime import datetime, timedelta
+import pytest
+
+# Modules under src import each other by their flat names, as they do when
+# run from there. Tests import them the same way, so each is loaded once.
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), "..", "src"))
+
+import app as appmod
+import auth
+import db
+import job
+import scratch
+
+SCHEMA = os.path.join(os.path.dirname(__file__), "..", "schema.sql")
+START = datetime(2024, 1, 1)
+
+
+@pytest.fixture
+def database(tmp_path, monkeypatch) -> db.DB:
+    instance = db.DB(str(tmp_path / "db.sqlite"))
+    with open(SCHEMA) as f:
+        instance.runScript(f.read())
+
+    monkeypatch.setattr(db, "_instance", instance)
+    return instance
+
+@pytest.fixture
+def scratchSpace(tmp_path, monkeypatch) -> scratch.ScratchSpace:
+    instance = scratch.ScratchSpace(str(tmp_path / "scratch"), headroomBytes=0)
+    monkeypatch.setattr(scratch, "_instance", instance)
+    return instance
+
+@pytest.fixture
+def manager(database, scratchSpace, monkeypatch) -> job.JobManager:
+    instance = job.JobManager(prefetchWindow=2)
+    monkeypatch.setattr(job, "_instance", instance)
+    return instance
+
+@pytest.fixture
+def filesFolder(tmp_path, monkeypatch) -> str:
+    folder = str(tmp_path / "files")
+    os.makedirs(folder)
+    monkeypatch.setattr(appmod, "FILES_FOLDER", folder)
+    return folder
+
+@pytest.fixture
+def apiKey(database) -> str:
+    database.runUpdateQuery("INSERT INTO Client (apikey, revoked) VALUES (?,?)", ["client", False])
+    return "client"
+
+@pytest.fixture
+def workerKey(monkeypatch) -> str:
+    monkeypatch.setattr(auth, "WORKER_API_KEYS", ["worker"])
+    return "worker"
+
+@pytest.fixture
+def client(manager, filesFolder, apiKey, workerKey):
+    return appmod.app.test_client()
+
+@pytest.fixture
+def newJob(filesFolder):
+    """
+    Persists a pending job created `minutes` after START, its source and
+    output in the files folder. Other VideoCompressorJobData fields are
+    passed through.
+    """
+    def create(uuid: str, minutes: int = 0, **fields) -> job.VideoCompressionJob:
+        obj = job.VideoCompressionJob(job.VideoCompressorJobData(
+            job.BaseJobData(uuid, job.JobState.PENDING, job.JobType.VIDEO_COMPRESSION_JOB, START + timedelta(minutes=minutes), None, "client"),
+            os.path.join(filesFolder, f"{uuid}.mp4"),
+            os.path.join(filesFolder, f"{uuid}_out.mp4"),
+            "480p",
+            30,
+            24,
+            **fields
+        ))
+        obj.persist()
+        return obj
+
+    return create
@@ -0,0 +1,48 @@
+import math
+from admission import TokenBucket, AdmissionController, checkBackpressure, MAX_QUEUE_DEPTH, MIN_FREE_BYTES, ENCODE_SECONDS_IN_FLIGHT
+
+def test_tokenBucket():
+    bucket = TokenBucket(rate=2, capacity=4, now=0)
+
+    # Starts full, so a burst up to the capacity is allowed
+    for _ in range(4):
+        assert bucket.take(1, now=0) == 0
+
+    # Empty, the wait is how long the missing tokens take to refill
+    assert bucket.take(1, now=0) == 0.5
+    assert bucket.take(1, now=0.5) == 0
+
+    # Refill never goes above capacity
+    assert bucket.take(4, now=100) == 0
+
+    # A request larger than the bucket can never be granted
+    assert bucket.take(5, now=200) == math.inf
+
+def test_reserveEncode():
+    controller = AdmissionController()
+
+    assert controller.reserveEncode("key", "a", ENCODE_SECONDS_IN_FLIGHT * 0.75) is None
+
+    rejection = controller.reserveEncode("key", "b", ENCODE_SECONDS_IN_FLIGHT * 0.5)
+    assert rejection.status == 429
+    assert rejection.retryAfter == ENCODE_SECONDS_IN_FLIGHT * 0.25
+
+    # Budgets are per key
+    assert controller.reserveEncode("other", "c", ENCODE_SECONDS_IN_FLIGHT * 0.5) is None
+
+    controller.releaseEncode("a")
+    assert controller.reserveEncode("key", "b", ENCODE_SECONDS_IN_FLIGHT * 0.5) is None
+
+def test_reserveEncode_oversizedJobWhenIdle():
+    controller = AdmissionController()
+
+    assert controller.reserveEncode("key", "a", ENCODE_SECONDS_IN_FLIGHT * 2) is None
+    assert controller.reserveEncode("key", "b", 1).status == 429
+
+def test_checkBackpressure():
+    assert checkBackpressure(0, 0, MIN_FREE_BYTES) is None
+    assert checkBackpressure(0, 0, MIN_FREE_BYTES - 1).status == 503
+
+    rejection = checkBackpressure(MAX_QUEUE_DEPTH, MAX_QUEUE_DEPTH * 10, MIN_FREE_BYTES)
+    assert rejection.status == 503
+    assert rejection.retryAfter == 10
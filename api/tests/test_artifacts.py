@@ -0,0 +1,138 @@
+import os
+import time
+from datetime import datetime, timedelta
+import pytest
+import app as appmod
+import fsgc
+from ffmpeg import ArtifactConfig, artifactConfigFor, buildArtifactGraph, buildCompressionCommand, encodeArgs, scaleFilter
+
+def test_artifactConfigFor():
+    artifacts = artifactConfigFor("/scratch/a/out.mp4", ["poster", "sprite"])
+
+    assert artifacts.posterPath == "/scratch/a/out_poster.jpg"
+    assert artifacts.spritePattern == "/scratch/a/out_sprite_%03d.jpg"
+    assert artifacts.previewPath is None
+    assert artifacts.kinds() == ["poster", "sprite"]
+
+def test_buildArtifactGraph():
+    artifacts = artifactConfigFor("/out.mp4", ["poster", "sprite", "preview"])
+
+    graph, outputs = buildArtifactGraph(artifacts, scaleFilter("480p"))
+    branches = graph.split(";")
+
+    # One split branch per artifact plus the main output
+    assert branches[0] == "[0:v]split=4[mainin][posterin][spritein][previewin]"
+    assert branches[1] == f"[mainin]{scaleFilter('480p')}[main]"
+    for branch, kind in zip(branches[2:], ["poster", "sprite", "preview"]):
+        assert branch.startswith(f"[{kind}in]") and branch.endswith(f"[{kind}]")
+
+    # Every artifact output maps its own label and ends in its path
+    for label, path in [("[poster]", artifacts.posterPath), ("[sprite]", artifacts.spritePattern), ("[preview]", artifacts.previewPath)]:
+        start = outputs.index(label) - 1
+        assert outputs[start] == "-map"
+        end = outputs.index(path)
+        assert "-map" not in outputs[start + 2:end]
+
+def test_buildArtifactGraph_singleArtifact():
+    graph, outputs = buildArtifactGraph(artifactConfigFor("/out.mp4", ["poster"]), "null")
+
+    assert graph.startswith("[0:v]split=2[mainin][posterin];")
+    assert outputs.count("-map") == 1
+
+def test_buildCompressionCommand_withArtifacts():
+    artifacts = artifactConfigFor("/out.mp4", ["poster"])
+
+    command = buildCompressionCommand("/in.mkv", 28, 30, "/out.mp4", "720p", artifacts, "libx264", "slow")
+    main = command[command.index("[main]") - 1:command.index("/out.mp4") + 1]
+
+    # The main output keeps the source audio and the full encode args
+    assert main[:4] == ["-map", "[main]", "-map", "0:a?"]
+    assert main[4:-1] == encodeArgs("/in.mkv", 28, 30, "libx264", "slow")
+    assert command[command.index("-filter_complex") + 1].startswith("[0:v]split=2")
+    assert command[-1] == artifacts.posterPath
+    assert "-filter:v" not in command
+
+def test_buildCompressionCommand_withoutArtifacts():
+    command = buildCompressionCommand("/in.mp4", 28, 30, "/out.mp4", "720p")
+
+    assert "-filter_complex" not in command
+    assert command[command.index("-filter:v") + 1] == scaleFilter("720p")
+    assert command[-1] == "/out.mp4"
+
+def test_producedPaths(tmp_path):
+    artifacts = artifactConfigFor(str(tmp_path / "out.mp4"), ["poster", "sprite", "preview"])
+    for name in ["out_poster.jpg", "out_sprite_001.jpg", "out_sprite_000.jpg", "out_sprite_abc.jpg"]:
+        (tmp_path / name).write_bytes(b"x")
+
+    assert artifacts.producedPaths() == {
+        "poster": [str(tmp_path / "out_poster.jpg")],
+        "sprite": [str(tmp_path / "out_sprite_000.jpg"), str(tmp_path / "out_sprite_001.jpg")],
+        # ffmpeg failed before writing it
+        "preview": [],
+    }
+
+    artifacts.removeProduced()
+    assert sorted(os.listdir(tmp_path)) == ["out_sprite_abc.jpg"]
+
+def test_producedPaths_noArtifacts():
+    assert ArtifactConfig().producedPaths() == {}
+
+
+@pytest.fixture
+def withArtifacts(manager, newJob, filesFolder):
+    obj = newJob("a", artifacts=["poster", "sprite"])
+    produced = {
+        "poster": [os.path.join(filesFolder, "a_out_poster.jpg")],
+        "sprite": [os.path.join(filesFolder, "a_out_sprite_000.jpg"), os.path.join(filesFolder, "a_out_sprite_001.jpg")],
+    }
+    obj.saveArtifacts(produced)
+    return obj, produced
+
+def test_saveArtifacts_roundTrip(manager, withArtifacts):
+    obj, produced = withArtifacts
+
+    assert manager.getJobById("a").getArtifacts() == produced
+
+def test_getArtifacts_requestedButMissing(manager, newJob):
+    obj = newJob("b", artifacts=["preview"])
+
+    assert obj.getArtifacts() == {"preview": []}
+
+def test_artifactUrls(client, apiKey, withArtifacts, tmp_path, monkeypatch):
+    monkeypatch.setitem(appmod.app.config, "UPLOAD_FOLDER", str(tmp_path))
+
+    response = client.get("/job/artifacts", headers={"X-API-Key": apiKey}, query_string={"id": "a"})
+
+    assert response.status_code == 200
+    assert response.json["artifacts"]["poster"] == [{
+        "file_path": os.path.join(str(tmp_path), "files", "a_out_poster.jpg"),
+        "file_name": "a_out_poster.jpg",
+        "url": "/api_data/files/a_out_poster.jpg",
+    }]
+    assert [artifact["url"] for artifact in response.json["artifacts"]["sprite"]] == [
+        "/api_data/files/a_out_sprite_000.jpg",
+        "/api_data/files/a_out_sprite_001.jpg",
+    ]
+
+def test_artifactsFollowJobExpiry(manager, withArtifacts, filesFolder):
+    obj, produced = withArtifacts
+    old = time.time() - 3 * 24 * 60 * 60
+
+    paths = produced["poster"] + produced["sprite"] + [os.path.join(filesFolder, "unrelated.jpg")]
+    for path in paths:
+        with open(path, "wb") as f:
+            f.write(b"x")
+        os.utime(path, (old, old))
+
+    assert [related.baseData.uuid for related in manager.getRelatedJobs(produced["sprite"][1])] == ["a"]
+
+    # Old files of a job that hasn't expired are kept, unrelated ones go
+    obj.setExpiresAt(datetime.now() + timedelta(days=1))
+    obj.persist()
+    fsgc.removeInvalidFiles(filesFolder)
+    assert sorted(os.listdir(filesFolder)) == sorted(os.path.basename(path) for path in produced["poster"] + produced["sprite"])
+
+    obj.setExpiresAt(datetime.now() - timedelta(minutes=1))
+    obj.persist()
+    fsgc.removeInvalidFiles(filesFolder)
+    assert os.listdir(filesFolder) == []
@@ -0,0 +1,115 @@
+import asyncio
+import threading
+import job
+import supervisor
+
+def cancel(client, key: str, uuid: str):
+    return client.delete("/job", headers={"X-API-Key": key}, query_string={"id": uuid})
+
+def watchFinished(manager) -> threading.Event:
+    # Set once finalization is over, the state alone turns before that
+    finished = threading.Event()
+    manager.finishedListeners.append(lambda obj: finished.set())
+    return finished
+
+
+def test_cancelPendingJobInWindow(client, apiKey, manager, newJob):
+    newJob("a")
+    newJob("b", 1)
+    manager.recoverStateFromDatabase()
+    manager.refillWindow()
+
+    response = cancel(client, apiKey, "a")
+
+    assert response.status_code == 200
+    assert response.json["state"] == "CANCELLED"
+    assert [obj.baseData.uuid for obj in manager.window] == ["b"]
+    assert manager.pendingCount == 1
+    assert manager.getJobById("a").baseData.expiresAt is not None
+
+def test_cancelPendingJobNotLoaded(client, apiKey, manager, newJob):
+    newJob("a")
+    manager.recoverStateFromDatabase()
+
+    assert cancel(client, apiKey, "a").json["state"] == "CANCELLED"
+    assert manager.pendingCount == 0
+    # The refill no longer sees it
+    manager.refillWindow()
+    assert len(manager.window) == 0
+
+def test_cancelOtherClientsJob(client, apiKey, database, manager, newJob):
+    newJob("a")
+    database.runUpdateQuery("INSERT INTO Client (apikey, revoked) VALUES (?,?)", ["other", False])
+
+    assert cancel(client, "other", "a").status_code == 403
+    assert manager.getJobById("a").baseData.state == job.JobState.PENDING
+
+def test_cancelUnknownJob(client, apiKey):
+    assert cancel(client, apiKey, "missing").status_code == 404
+
+def test_cancelFinishedJob(client, apiKey, newJob):
+    for uuid, state in [("a", job.JobState.COMPLETED), ("b", job.JobState.FAILED)]:
+        obj = newJob(uuid)
+        obj.baseData.state = state
+        obj.persist()
+
+        response = cancel(client, apiKey, uuid)
+        assert response.status_code == 409
+        assert state.name in response.json["error"]
+
+def test_cancelRunningJob(client, apiKey, manager, newJob, monkeypatch):
+    newJob("a")
+    manager.recoverStateFromDatabase()
+    running = manager.getNextJob()
+
+    async def encodeForever():
+        try:
+            await asyncio.sleep(3600)
+        finally:
+            # Killing and reaping the process group takes a moment
+            await asyncio.sleep(0.5)
+    monkeypatch.setattr(running, "runAsync", encodeForever)
+    finished = watchFinished(manager)
+    manager.slots.acquire()
+    manager.startJob(running)
+
+    # Accepted, the job turns CANCELLED once the encode is gone
+    response = cancel(client, apiKey, "a")
+    assert response.status_code == 202
+    assert response.json["state"] == "PENDING"
+
+    assert finished.wait(5)
+    cancelled = manager.getJobById("a")
+    assert cancelled.baseData.state == job.JobState.CANCELLED
+    assert cancelled.baseData.expiresAt is not None
+    assert manager.pendingCount == 0
+    assert "a" not in manager.futures
+
+
+def test_stalledJobIsRequeued(manager, newJob):
+    newJob("a")
+    manager.recoverStateFromDatabase()
+
+    stalled = manager.getNextJob()
+    manager.completeJob(stalled, supervisor.ProcessStalled("no progress", []))
+
+    assert stalled.baseData.state == job.JobState.PENDING
+    assert stalled.baseData.attempts == 1
+    assert manager.pendingCount == 1
+    assert manager.getNextJob() is stalled
+
+def test_stalledTooOftenFails(manager, newJob, monkeypatch):
+    monkeypatch.setattr(job, "STALL_MAX_RETRIES", 2)
+    newJob("a")
+    manager.recoverStateFromDatabase()
+
+    for attempt in range(2):
+        manager.completeJob(manager.getNextJob(), supervisor.ProcessStalled("no progress", []))
+        assert manager.getJobById("a").baseData.attempts == attempt + 1
+
+    stalled = manager.getNextJob()
+    manager.completeJob(stalled, supervisor.ProcessStalled("no progress", []))
+
+    assert stalled.baseData.state == job.JobState.FAILED
+    assert manager.getJobById("a").baseData.state == job.JobState.FAILED
+    assert manager.pendingCount == 0
@@ -0,0 +1,80 @@
+import asyncio
+import os
+import chunked
+import ffmpeg
+from chunked import Chunk, parseSegmentList
+
+def test_parseSegmentList():
+    lines = [
+        "source_00000.mkv,0.000000,300.033333\n",
+        "source_00001.mkv,300.033333,600.000000\n",
+        "\n",
+        "source_00002.mkv,600.000000,612.500000\n",
+    ]
+
+    assert parseSegmentList(lines) == [
+        Chunk(0, 0.0, 300.033333),
+        Chunk(1, 300.033333, 600.0),
+        Chunk(2, 600.0, 612.5),
+    ]
+
+def test_parseSegmentList_skipsMalformedRows():
+    assert parseSegmentList(["source_00000.mkv,0.0\n", "source_00000.mkv,0.0,1.0,extra\n"]) == []
+
+
+def runChunked(obj, workdir: str, monkeypatch) -> dict:
+    calls = {"split": 0, "encoded": [], "concatenated": []}
+
+    async def splitSource(location, workdir):
+        calls["split"] += 1
+        chunks = [Chunk(i, i * 10.0, (i + 1) * 10.0) for i in range(3)]
+        for chunk in chunks:
+            open(chunk.sourcePath(workdir), "wb").close()
+        return chunks
+
+    async def encodeChunk(chunk, workdir, config, onProgress=None):
+        calls["encoded"].append(chunk.index)
+        open(chunk.encodedPath(workdir), "wb").close()
+
+    async def concatChunks(chunks, workdir, location, outpath, codec):
+        calls["concatenated"] = [chunk.index for chunk in chunks]
+
+    monkeypatch.setattr(chunked, "splitSource", splitSource)
+    monkeypatch.setattr(chunked, "encodeChunk", encodeChunk)
+    monkeypatch.setattr(chunked, "concatChunks", concatChunks)
+
+    config = ffmpeg.CompressVideoConfig(os.path.join(workdir, "out.mp4"), obj.originalFilePath, obj.factor, obj.framerate, obj.quality)
+    asyncio.run(obj.runChunked(config))
+    return calls
+
+def test_runChunked_resumesFromCompletedChunks(manager, newJob, tmp_path, monkeypatch):
+    obj = newJob("a", chunked=True)
+    workdir = str(tmp_path)
+
+    chunks = [Chunk(0, 0.0, 10.0, True), Chunk(1, 10.0, 20.0, True), Chunk(2, 20.0, 30.0)]
+    obj.saveChunks(chunks)
+    # Chunk 0 is done, chunk 1 lost its encode and chunk 2 never ran
+    open(chunks[0].encodedPath(workdir), "wb").close()
+    open(chunks[1].sourcePath(workdir), "wb").close()
+    open(chunks[2].sourcePath(workdir), "wb").close()
+
+    calls = runChunked(obj, workdir, monkeypatch)
+
+    assert calls["split"] == 0
+    assert calls["encoded"] == [1, 2]
+    assert calls["concatenated"] == [0, 1, 2]
+    assert all(chunk.completed for chunk in obj.loadChunks())
+    # Sources are dropped once encoded
+    assert not os.path.exists(chunks[2].sourcePath(workdir))
+
+def test_runChunked_splitsAgainWhenScratchIsLost(manager, newJob, tmp_path, monkeypatch):
+    obj = newJob("a", chunked=True)
+    workdir = str(tmp_path)
+
+    obj.saveChunks([Chunk(0, 0.0, 10.0, True), Chunk(1, 10.0, 20.0)])
+
+    calls = runChunked(obj, workdir, monkeypatch)
+
+    assert calls["split"] == 1
+    assert calls["encoded"] == [0, 1, 2]
+    assert len(obj.loadChunks()) == 3
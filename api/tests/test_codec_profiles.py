@@ -0,0 +1,75 @@
+import pytest
+from codec_profiles import CostModel, PresetMeasurement, getProfile, MIN_MEASUREMENTS
+
+def test_videoArgs():
+    x264 = getProfile("libx264")
+    assert x264.videoArgs(23, "slow") == ["-c:v", "libx264", "-crf", "23", "-preset", "slow"]
+
+    vp9 = getProfile("libvpx-vp9")
+    assert vp9.videoArgs(31, "4") == ["-c:v", "libvpx-vp9", "-crf", "31", "-deadline", "good", "-cpu-used", "4", "-b:v", "0", "-row-mt", "1"]
+
+    with pytest.raises(Exception):
+        x264.videoArgs(23, "8")
+
+def test_audioArgs():
+    assert getProfile("libx265").audioArgs("mp4") == ["-c:a", "copy"]
+    assert getProfile("libvpx-vp9").audioArgs("mp4") == ["-c:a", "libopus"]
+    assert getProfile("libvpx-vp9").audioArgs("webm") == ["-c:a", "copy"]
+
+def test_presetRange():
+    x264 = getProfile("libx264")
+    assert x264.presetRange("fast", "slow") == ["fast", "medium", "slow"]
+
+    with pytest.raises(ValueError):
+        x264.presetRange("slow", "fast")
+
+def test_choosePreset():
+    model = CostModel()
+    x264 = getProfile("libx264")
+
+    # Idle queue gets the smallest output, a full one the fastest encode
+    assert model.choosePreset(x264, "veryfast", "veryslow", 0) == "veryslow"
+    assert model.choosePreset(x264, "veryfast", "veryslow", 1) == "veryfast"
+    assert model.choosePreset(x264, "medium", "medium", 1) == "medium"
+
+    chosen = model.choosePreset(x264, "veryfast", "veryslow", 0.5)
+    assert x264.presets.index("veryfast") < x264.presets.index(chosen) < x264.presets.index("veryslow")
+
+def test_calibrate():
+    model = CostModel()
+
+    model.calibrate([
+        PresetMeasurement("libx264", "medium", 1000, 0.5, MIN_MEASUREMENTS),
+        PresetMeasurement("libx264", "slow", 250, 0.4, MIN_MEASUREMENTS),
+        # Too few jobs to be trusted
+        PresetMeasurement("libx264", "fast", 100000, 0.1, MIN_MEASUREMENTS - 1),
+    ])
+
+    assert model.cost("libx264", "medium").speed == 1
+    assert model.cost("libx264", "slow").speed == 0.25
+    assert model.cost("libx264", "slow").size == pytest.approx(0.8)
+    assert model.cost("libx264", "fast").speed == 1.8
+
+def test_calibrate_withoutDefaultPreset():
+    model = CostModel()
+
+    # Nothing ran at medium, slow has the most jobs and keeps its seed
+    model.calibrate([
+        PresetMeasurement("libx264", "slow", 600, 0.5, MIN_MEASUREMENTS + 3),
+        PresetMeasurement("libx264", "veryslow", 150, 0.45, MIN_MEASUREMENTS),
+    ])
+
+    assert model.cost("libx264", "slow").speed == 0.6
+    assert model.cost("libx264", "veryslow").speed == pytest.approx(0.15)
+    assert model.cost("libx264", "veryslow").size == pytest.approx(0.97 * 0.9)
+    assert model.cost("libx264", "medium").speed == 1
+
+def test_choosePreset_skipsDominated():
+    model = CostModel()
+    model.calibrate([
+        PresetMeasurement("libx264", "medium", 1000, 0.5, MIN_MEASUREMENTS),
+        # Slower than medium and still larger
+        PresetMeasurement("libx264", "slow", 500, 0.6, MIN_MEASUREMENTS),
+    ])
+
+    assert model.choosePreset(getProfile("libx264"), "medium", "slow", 0) == "medium"
@@ -0,0 +1,77 @@
+import asyncio
+import pytest
+import crf_search
+from crf_search import QualityTarget, parseQualityScore, sampleOffsets, SAMPLE_COUNT, SAMPLE_SECONDS
+
+def test_parseQualityScore_ssim():
+    lines = [
+        "frame=  100 fps=0.0 q=-0.0 size=N/A",
+        "[Parsed_ssim_4 @ 0x5581] SSIM Y:0.981234 (17.26) U:0.990001 (20.00) V:0.989999 (19.99) All:0.984512 (18.10)",
+    ]
+
+    assert parseQualityScore("ssim", lines) == pytest.approx(0.984512)
+
+def test_parseQualityScore_psnr():
+    lines = ["[Parsed_psnr_4 @ 0x5581] PSNR y:41.12 u:44.50 v:44.01 average:42.031742 min:38.70 max:45.90"]
+    assert parseQualityScore("psnr", lines) == pytest.approx(42.031742)
+
+    # Identical frames have an infinite PSNR
+    lines = ["[Parsed_psnr_4 @ 0x5581] PSNR y:inf u:inf v:inf average:inf min:inf max:inf"]
+    assert parseQualityScore("psnr", lines) == float("inf")
+
+def test_parseQualityScore_missing():
+    assert parseQualityScore("ssim", ["Conversion failed!"]) is None
+    assert parseQualityScore("psnr", ["[Parsed_ssim_4 @ 0x5581] SSIM All:0.98 (17.0)"]) is None
+
+def test_sampleOffsets_shortSource():
+    assert sampleOffsets(SAMPLE_SECONDS * SAMPLE_COUNT) == [(0, SAMPLE_SECONDS * SAMPLE_COUNT)]
+    assert sampleOffsets(2.5) == [(0, 2.5)]
+
+def test_sampleOffsets_longSource():
+    samples = sampleOffsets(100.0)
+
+    assert len(samples) == SAMPLE_COUNT
+    assert all(seconds == SAMPLE_SECONDS for _, seconds in samples)
+    # Spread evenly, all within the source
+    assert all(0 <= offset and offset + seconds <= 100.0 for offset, seconds in samples)
+    assert [offset for offset, _ in samples] == sorted(offset for offset, _ in samples)
+
+
+def search(monkeypatch, score, target: float, minCrf: int):
+    measured = []
+
+    async def probeDuration(location):
+        return 60.0
+
+    async def measureCrf(location, quality, metric, crf, samples, workdir, profile, preset):
+        measured.append(crf)
+        return score(crf)
+
+    monkeypatch.setattr(crf_search, "probeDuration", probeDuration)
+    monkeypatch.setattr(crf_search, "measureCrf", measureCrf)
+
+    result = asyncio.run(crf_search.searchCrf("in.mp4", "480p", QualityTarget("psnr", target), minCrf, "libx264"))
+    return result, measured
+
+def test_searchCrf_converges(monkeypatch):
+    result, measured = search(monkeypatch, lambda crf: 70.0 - crf, 40.0, 18)
+
+    # Highest CRF still meeting the target
+    assert result.crf == 30
+    assert result.score == 40.0
+    # Binary search over [18, 50]
+    assert len(measured) <= 6
+
+def test_searchCrf_clampsToMaxCrf(monkeypatch):
+    result, measured = search(monkeypatch, lambda crf: 100.0, 40.0, 18)
+
+    assert result.crf == crf_search.codec_profiles.getProfile("libx264").maxCrf
+    assert max(measured) == result.crf
+
+def test_searchCrf_clampsToMinCrf(monkeypatch):
+    # Even minCrf misses the target, it is returned with its own score
+    result, measured = search(monkeypatch, lambda crf: 10.0 - crf / 10, 40.0, 20)
+
+    assert result.crf == 20
+    assert result.score == 8.0
+    assert min(measured) == 20
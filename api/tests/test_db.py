@@ -0,0 +1,76 @@
+import os
+from db import DB, runMigrations
+
+SCHEMA = os.path.join(os.path.dirname(__file__), "..", "schema.sql")
+
+# The schema as first shipped, before any migration
+BASELINE_SCHEMA = """
+CREATE TABLE jobs (
+    uuid UUID PRIMARY KEY,
+    state TEXT CHECK(state IN ('PENDING', 'COMPLETED', 'FAILED')),
+    type TEXT CHECK(type IN ('VIDEO_COMPRESSION_JOB')),
+    createdAt TIMESTAMP NOT NULL,
+    expiresAt TIMESTAMP
+);
+
+CREATE TABLE VideoCompressionJob (
+    job UUID,
+    originalFilePath TEXT NOT NULL,
+    destinationFilePath TEXT NOT NULL,
+    quality TEXT NOT NULL,
+    factor INT NOT NULL,
+    framerate INT NOT NULL,
+    FOREIGN KEY (job) REFERENCES jobs(id)
+);
+
+CREATE TABLE VideoCompressionStatistics (
+    vcj UUID,
+    originalSizeBytes INT NOT NULL,
+    finalSizeBytes INT NOT NULL,
+    startTimestamp INT NOT NULL,
+    endTimestamp INT NOT NULL,
+    FOREIGN KEY (vcj) REFERENCES VideoCompressionJob(job)
+);
+
+CREATE TABLE Client (
+    apikey UUID NOT NULL,
+    revoked BOOLEAN NOT NULL
+);
+
+INSERT INTO jobs VALUES ('a', 'COMPLETED', 'VIDEO_COMPRESSION_JOB', '2024-01-01T00:00:00', NULL);
+INSERT INTO VideoCompressionJob VALUES ('a', 'in.mp4', 'out.mp4', '480p', 30, 24);
+"""
+
+def migrate(path: str) -> DB:
+    db = DB(path)
+    db.runScript(BASELINE_SCHEMA)
+
+    runMigrations(db)
+    with open(SCHEMA) as f:
+        db.runScript(f.read())
+
+    return db
+
+def test_migrateFromBaseline(tmp_path):
+    db = migrate(str(tmp_path / "db.sqlite"))
+
+    assert db.runGetQuery("SELECT uuid, state, owner, attempts FROM jobs") == [("a", "COMPLETED", None, 0)]
+    assert db.runUpdateQuery("UPDATE jobs SET state = 'CANCELLED' WHERE uuid = 'a'") == 1
+
+    tables = [row[0] for row in db.runGetQuery("SELECT name FROM sqlite_master WHERE type = 'table'")]
+    assert "jobs_new" not in tables
+
+def test_migrateKeepsForeignKeys(tmp_path):
+    db = migrate(str(tmp_path / "db.sqlite"))
+
+    sql = db.runGetQuery("SELECT sql FROM sqlite_master WHERE name = 'VideoCompressionJob'")[0][0]
+    assert "REFERENCES jobs(" in sql
+    assert "jobs_new" not in sql
+
+def test_migrateIsIdempotent(tmp_path):
+    path = str(tmp_path / "db.sqlite")
+    migrate(path)
+
+    db = DB(path)
+    runMigrations(db)
+    assert db.runGetQuery("SELECT uuid FROM jobs") == [("a",)]
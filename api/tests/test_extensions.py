@@ -1,6 +1,6 @@
 import pytest
 import uuid
-from src.extensions import isMediaTypeAllowed, mediaTypeToExtension, extractExtension, generateFileNameByMedia
+from extensions import isMediaTypeAllowed, mediaTypeToExtension, extractExtension, generateFileNameByMedia
 
 def test_isMediaTypeAllowed():
     # Test valid media type
@@ -12,6 +12,7 @@ def test_isMediaTypeAllowed():
 def test_mediaTypeToExtension():
     # Test valid media type
     assert mediaTypeToExtension('video/mp4') == 'mp4'
+    assert mediaTypeToExtension('video/webm') == 'webm'
 
     # Test invalid media type (function should not return anything)
     assert mediaTypeToExtension('audio/mp3') == None
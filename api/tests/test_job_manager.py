@@ -0,0 +1,90 @@
+import job
+
+def persistJobs(newJob, count: int) -> list[str]:
+    uuids = [f"job{i}" for i in range(count)]
+    for i, uuid in enumerate(uuids):
+        newJob(uuid, i)
+
+    return uuids
+
+def test_startupLoadsOnlyTheWindow(manager, newJob):
+    persistJobs(newJob, 5)
+    manager.recoverStateFromDatabase()
+
+    assert manager.pendingCount == 5
+    assert len(manager.window) == 0
+
+    assert manager.getNextJob().baseData.uuid == "job0"
+    assert [obj.baseData.uuid for obj in manager.window] == ["job1"]
+
+def test_refillContinuesAfterCursor(manager, newJob):
+    uuids = persistJobs(newJob, 5)
+    manager.recoverStateFromDatabase()
+
+    handedOut = []
+    for _ in uuids:
+        handedOut.append(manager.getNextJob().baseData.uuid)
+        assert len(manager.window) <= manager.prefetchWindow
+
+    assert handedOut == uuids
+    assert manager.cursor[1] == "job4"
+
+def test_pushBehindCursorGoesIntoWindow(manager, newJob):
+    persistJobs(newJob, 3)
+    manager.recoverStateFromDatabase()
+    manager.getNextJob()
+    manager.getNextJob()
+
+    # Created before the cursor, the next refill would skip it
+    late = newJob("late", -1)
+    manager.pushJob(late)
+    assert late in manager.window
+
+    # Created after the cursor, the refill picks it up from the database
+    manager.pushJob(newJob("new", 10))
+    assert [manager.getNextJob().baseData.uuid for _ in range(2)] == ["late", "job2"]
+    assert manager.getNextJob().baseData.uuid == "new"
+    assert manager.pendingCount == 5
+
+def test_requeuedJobIsHandedOutAgain(manager, newJob):
+    persistJobs(newJob, 3)
+    manager.recoverStateFromDatabase()
+
+    stalled = manager.getNextJob()
+    manager.activeJobs.pop(stalled.baseData.uuid)
+    manager.pushJob(stalled, save=False, requeue=True)
+
+    assert manager.pendingCount == 3
+    assert [manager.getNextJob().baseData.uuid for _ in range(3)] == ["job1", "job0", "job2"]
+
+def test_remoteWorkersOnly(manager, newJob, monkeypatch):
+    # ENCODE_SLOTS=0 leaves all encodes to remote workers
+    remoteOnly = job.JobManager(prefetchWindow=2, slots=0)
+    monkeypatch.setattr(job, "_instance", remoteOnly)
+
+    newJob("job0")
+    remoteOnly.recoverStateFromDatabase()
+
+    lease = remoteOnly.claimJob("w1")
+    assert lease is not None
+    assert lease.job.baseData.uuid == "job0"
+    assert remoteOnly.getParallelism() == 1
+
+def test_claimLooksPastWindowOfLocalOnlyJobs(manager, newJob):
+    # Jobs with artifacts can't be leased, and they fill the whole window
+    for i, uuid in enumerate(["a", "b", "c", "d"]):
+        newJob(uuid, i, artifacts=["thumbnail"] if uuid in ["a", "b"] else [])
+    manager.recoverStateFromDatabase()
+    manager.refillWindow()
+
+    assert [obj.baseData.uuid for obj in manager.window] == ["a", "b"]
+    assert manager.claimJob("w1").job.baseData.uuid == "c"
+    assert manager.claimJob("w2").job.baseData.uuid == "d"
+    assert manager.claimJob("w3") is None
+    assert [obj.baseData.uuid for obj in manager.window] == ["a", "b"]
+
+    # The refill later skips the leased jobs
+    manager.getNextJob()
+    manager.getNextJob()
+    manager.refillWindow()
+    assert len(manager.window) == 0
@@ -0,0 +1,94 @@
+import base64
+import pytest
+from job_query import JobListFilter, decodeCursor, encodeCursor, listJobs
+
+def test_cursorRoundTrip():
+    assert decodeCursor(encodeCursor("2024-01-01 00:00:00", "abc")) == ("2024-01-01 00:00:00", "abc")
+
+def test_pagesBreakTiesOnUuid(manager, newJob):
+    # Three jobs share a createdAt, a page boundary falls between them
+    newJob("a")
+    newJob("b", 1)
+    newJob("c", 1)
+    newJob("d", 1)
+    newJob("e", 2)
+
+    seen = []
+    cursor = None
+    while True:
+        page = listJobs(JobListFilter(), cursor, 2)
+        seen.extend(obj.baseData.uuid for obj in page.jobs)
+        cursor = page.nextCursor
+        if cursor is None:
+            break
+
+    assert seen == ["e", "d", "c", "b", "a"]
+
+def test_lastPageHasNoCursor(manager, newJob):
+    newJob("a")
+    newJob("b")
+
+    assert listJobs(JobListFilter(), None, 2).nextCursor is None
+    assert listJobs(JobListFilter(), None, 1).nextCursor is not None
+
+@pytest.mark.parametrize("cursor", [
+    "not a cursor",
+    base64.urlsafe_b64encode(b"no separator").decode(),
+    base64.urlsafe_b64encode(b"yesterday|abc").decode(),
+    base64.urlsafe_b64encode(b"2024-01-01 00:00:00|").decode(),
+    base64.urlsafe_b64encode(b"2024-01-01 00:00:00|abc|def").decode(),
+    base64.urlsafe_b64encode(b"\xff\xfe|abc").decode(),
+])
+def test_tamperedCursorIsRejected(client, apiKey, newJob, cursor):
+    newJob("a")
+
+    response = client.get("/jobs", headers={"X-API-Key": apiKey}, query_string={"cursor": cursor})
+
+    assert response.status_code == 400
+    assert response.json == {"error": "Invalid cursor"}
+
+
+def listing(client, key: str, etag: str | None = None, **query):
+    headers = {"X-API-Key": key}
+    if etag is not None:
+        headers["If-None-Match"] = etag
+
+    return client.get("/jobs", headers=headers, query_string=query)
+
+def test_unchangedListingIsNotModified(client, apiKey, newJob):
+    newJob("a")
+    etag = listing(client, apiKey, state="PENDING").headers["ETag"]
+
+    response = listing(client, apiKey, etag, state="PENDING")
+
+    assert response.status_code == 304
+    assert response.data == b""
+    assert response.headers["ETag"] == etag
+
+def test_etagIsScopedToQueryAndKey(client, apiKey, database, newJob):
+    newJob("a")
+    database.runUpdateQuery("INSERT INTO Client (apikey, revoked) VALUES (?,?)", ["other", False])
+    etag = listing(client, apiKey, state="PENDING", limit=5).headers["ETag"]
+
+    # Same query with its arguments in another order
+    assert listing(client, apiKey, etag, limit=5, state="PENDING").status_code == 304
+
+    assert listing(client, apiKey, etag, state="PENDING", limit=6).status_code == 200
+    assert listing(client, apiKey, etag, state="COMPLETED", limit=5).status_code == 200
+    assert listing(client, "other", etag, state="PENDING", limit=5).status_code == 200
+
+def test_changesInvalidateEtag(client, apiKey, manager, newJob):
+    obj = newJob("a")
+    etag = listing(client, apiKey).headers["ETag"]
+
+    manager.pushJob(newJob("b", 1))
+    response = listing(client, apiKey, etag)
+    assert response.status_code == 200
+    assert [item["uuid"] for item in response.json["jobs"]] == ["b", "a"]
+
+    etag = response.headers["ETag"]
+    obj.factor = 25
+    obj.save()
+    response = listing(client, apiKey, etag)
+    assert response.status_code == 200
+    assert response.json["jobs"][1]["factor"] == 25
@@ -0,0 +1,118 @@
+import errno
+import os
+import shutil
+import pytest
+from scratch import ScratchSpace, publish
+
+def test_reserve(tmp_path):
+    free = shutil.disk_usage(tmp_path).free
+    space = ScratchSpace(str(tmp_path / "scratch"), headroomBytes=free // 2)
+
+    assert space.reserve("a", free // 4, str(tmp_path)) is not None
+    # Same job again keeps its reservation instead of adding to it
+    assert space.reserve("a", free // 4, str(tmp_path)).sizeBytes == free // 4
+
+    # Scratch and destination share a volume, so "a" is only counted once
+    assert space.reserve("b", free // 8, str(tmp_path)) is not None
+    assert space.reserve("c", free // 4, str(tmp_path)) is None
+
+    space.release("a")
+    assert space.reserve("c", free // 4, str(tmp_path)) is not None
+
+def test_releaseRemovesWorkdir(tmp_path):
+    space = ScratchSpace(str(tmp_path / "scratch"), headroomBytes=0)
+
+    path = space.pathFor("a", "/api_data/files/out.mp4")
+    with open(path, "wb") as f:
+        f.write(b"x")
+
+    space.release("a")
+    assert not os.path.exists(space.workdir("a"))
+
+def test_reclaim(tmp_path):
+    space = ScratchSpace(str(tmp_path / "scratch"), headroomBytes=0)
+
+    with open(space.pathFor("a", "out.mp4"), "wb") as f:
+        f.write(b"x" * 10)
+    with open(os.path.join(space.folder, "stray"), "wb") as f:
+        f.write(b"x" * 5)
+
+    assert space.reclaim() == 15
+    assert os.listdir(space.folder) == []
+
+def test_reclaimKeepsResumableJobs(tmp_path):
+    space = ScratchSpace(str(tmp_path / "scratch"), headroomBytes=0)
+
+    with open(space.pathFor("a", "chunk.mkv"), "wb") as f:
+        f.write(b"x")
+    space.pathFor("b", "out.mp4")
+
+    # A requeued job keeps its files for the next attempt
+    space.release("a", removeFiles=False)
+
+    space.reclaim({"a"})
+    assert os.listdir(space.folder) == ["a"]
+
+def test_publish(tmp_path):
+    source = tmp_path / "source.mp4"
+    source.write_bytes(b"video")
+    (tmp_path / "files").mkdir()
+
+    publish(str(source), str(tmp_path / "files" / "out.mp4"))
+
+    assert not source.exists()
+    assert (tmp_path / "files" / "out.mp4").read_bytes() == b"video"
+
+def test_publish_acrossMounts(tmp_path, monkeypatch):
+    source = tmp_path / "source.mp4"
+    source.write_bytes(b"video")
+    mode = os.stat(source).st_mode & 0o777
+    (tmp_path / "files").mkdir()
+    destination = str(tmp_path / "files" / "out.mp4")
+
+    rename = os.replace
+    def crossDeviceReplace(src, dst):
+        # Only the scratch to destination rename crosses mounts
+        if src == str(source):
+            raise OSError(errno.EXDEV, "Invalid cross-device link")
+        rename(src, dst)
+
+    monkeypatch.setattr(os, "replace", crossDeviceReplace)
+    publish(str(source), destination)
+
+    assert not source.exists()
+    assert os.listdir(tmp_path / "files") == ["out.mp4"]
+    assert (tmp_path / "files" / "out.mp4").read_bytes() == b"video"
+    assert os.stat(tmp_path / "files" / "out.mp4").st_mode & 0o777 == mode
+
+def test_publish_acrossMountsCopyFails(tmp_path, monkeypatch):
+    source = tmp_path / "source.mp4"
+    source.write_bytes(b"video")
+    (tmp_path / "files").mkdir()
+
+    def crossDeviceReplace(src, dst):
+        raise OSError(errno.EXDEV, "Invalid cross-device link")
+
+    def fullDisk(src, dst):
+        with open(dst, "wb") as f:
+            f.write(b"vid")
+        raise OSError(errno.ENOSPC, "No space left on device")
+
+    monkeypatch.setattr(os, "replace", crossDeviceReplace)
+    monkeypatch.setattr(shutil, "copyfile", fullDisk)
+
+    with pytest.raises(OSError):
+        publish(str(source), str(tmp_path / "files" / "out.mp4"))
+
+    # Nothing partial is left in the served folder, the source is kept
+    assert os.listdir(tmp_path / "files") == []
+    assert source.read_bytes() == b"video"
+
+def test_usedBytes(tmp_path):
+    space = ScratchSpace(str(tmp_path / "scratch"), headroomBytes=0)
+    assert space.usedBytes("a") == 0
+
+    with open(space.pathFor("a", "/api_data/files/encoded_00000.mkv"), "wb") as f:
+        f.write(b"x" * 100)
+
+    assert space.usedBytes("a") == 100
@@ -0,0 +1,105 @@
+import asyncio
+import sys
+import time
+import pytest
+import concurrent.futures
+import threading
+from supervisor import runProcess, ProcessLimits, ProcessStalled, ProcessTimeout, STDERR_TAIL_LINES, Supervisor
+
+def isRunning(pid: int):
+    # Killed processes may linger as zombies until their new parent reaps them
+    try:
+        with open(f"/proc/{pid}/stat") as f:
+            return f.read().split(")")[-1].split()[0] != "Z"
+    except FileNotFoundError:
+        return False
+
+def python(code: str):
+    return [sys.executable, "-c", code]
+
+def test_runProcess_keepsStderrTail():
+    # Only the last STDERR_TAIL_LINES lines are kept
+    code = "import sys\nfor i in range(1000): print(i, file=sys.stderr)\nsys.exit(3)"
+    result = asyncio.run(runProcess(python(code)))
+
+    assert result.returncode == 3
+    assert len(result.stderrTail) == STDERR_TAIL_LINES
+    assert result.stderrTail[-1] == "999"
+
+def test_runProcess_reportsProgress():
+    code = "for i in range(3): print(f'frame={i}\\nout_time_us={i * 1000}\\nprogress=continue', flush=True)"
+    updates = []
+    result = asyncio.run(runProcess(python(code), onProgress=updates.append))
+
+    assert result.returncode == 0
+    assert [update["out_time_us"] for update in updates] == ["0", "1000", "2000"]
+
+def test_runProcess_noProgressTimeout(tmp_path):
+    # A process that keeps logging but never advances is still considered stalled
+    outpath = tmp_path / "out.mp4"
+    outpath.write_bytes(b"partial")
+    code = "import sys, time\nwhile True:\n    print('waiting', file=sys.stderr, flush=True)\n    time.sleep(0.1)"
+
+    with pytest.raises(ProcessStalled) as error:
+        asyncio.run(runProcess(python(code), ProcessLimits(noProgressTimeout=0.5), cleanupPaths=[str(outpath)]))
+
+    assert error.value.stderrTail[-1] == "waiting"
+    assert not outpath.exists()
+
+def test_runProcess_wallTimeout():
+    with pytest.raises(ProcessTimeout):
+        asyncio.run(runProcess(python("import time; time.sleep(30)"), ProcessLimits(wallTimeout=0.5)))
+
+def test_runProcess_cancelKillsProcessGroup(tmp_path):
+    # The child spawns a grandchild, both must be gone after cancellation
+    pidfile = tmp_path / "pid"
+    outpath = tmp_path / "out.mp4"
+    outpath.write_bytes(b"partial")
+    code = (
+        "import subprocess, sys, time\n"
+        f"child = subprocess.Popen([sys.executable, '-c', 'import time; time.sleep(30)'])\n"
+        f"open({str(pidfile)!r}, 'w').write(str(child.pid))\n"
+        "time.sleep(30)"
+    )
+
+    async def scenario():
+        task = asyncio.ensure_future(runProcess(python(code), cleanupPaths=[str(outpath)]))
+        while not pidfile.exists() or not pidfile.read_text():
+            await asyncio.sleep(0.05)
+        task.cancel()
+        with pytest.raises(asyncio.CancelledError):
+            await task
+
+    asyncio.run(scenario())
+
+    grandchild = int(pidfile.read_text())
+    for _ in range(50):
+        if not isRunning(grandchild):
+            break
+        time.sleep(0.05)
+
+    assert not isRunning(grandchild)
+    assert not outpath.exists()
+
+def test_supervisedTask_cancelResolvesAfterProcessDies(tmp_path):
+    pidfile = tmp_path / "pid"
+    code = f"import os, time\nopen({str(pidfile)!r}, 'w').write(str(os.getpid()))\ntime.sleep(30)"
+
+    task = Supervisor().submit(runProcess(python(code)))
+    while not pidfile.exists() or not pidfile.read_text():
+        time.sleep(0.05)
+
+    seen = []
+    finished = threading.Event()
+    def onDone(future):
+        seen.append((threading.current_thread() is threading.main_thread(), isRunning(int(pidfile.read_text())), future.cancelled()))
+        finished.set()
+
+    task.add_done_callback(onDone)
+    task.cancel()
+
+    # The callback must not run on the cancelling thread while ffmpeg lives
+    assert finished.wait(5)
+    assert seen == [(False, False, True)]
+    with pytest.raises(concurrent.futures.CancelledError):
+        task.result()
@@ -0,0 +1,42 @@
+import io
+import pytest
+from transfer import parseContentRange, formatContentRange, appendRange, receivedBytes
+
+def test_parseContentRange():
+    contentRange = parseContentRange("bytes 0-99/200")
+    assert (contentRange.start, contentRange.end, contentRange.total) == (0, 99, 200)
+    assert contentRange.length() == 100
+
+    # Round trips with formatContentRange
+    assert parseContentRange(formatContentRange(100, 100, 200)).start == 100
+
+    # Malformed or inconsistent ranges are rejected
+    assert parseContentRange(None) == None
+    assert parseContentRange("bytes 0-99") == None
+    assert parseContentRange("bytes 50-10/200") == None
+    assert parseContentRange("bytes 0-200/200") == None
+
+def test_appendRange_inOrder(tmp_path):
+    path = str(tmp_path / "out.part")
+
+    assert receivedBytes(path) == 0
+    assert appendRange(path, io.BytesIO(b"hello "), parseContentRange("bytes 0-5/11")) == 6
+    assert appendRange(path, io.BytesIO(b"world"), parseContentRange("bytes 6-10/11")) == 11
+
+    with open(path, "rb") as f:
+        assert f.read() == b"hello world"
+
+def test_appendRange_rejectsGaps(tmp_path):
+    path = str(tmp_path / "out.part")
+
+    with pytest.raises(ValueError):
+        appendRange(path, io.BytesIO(b"world"), parseContentRange("bytes 6-10/11"))
+
+def test_appendRange_keepsShortBody(tmp_path):
+    # A body cut short keeps what arrived so the client can resume from there
+    path = str(tmp_path / "out.part")
+
+    with pytest.raises(ValueError):
+        appendRange(path, io.BytesIO(b"hel"), parseContentRange("bytes 0-5/11"))
+
+    assert receivedBytes(path) == 3
@@ -0,0 +1,112 @@
+import os
+import time
+import pytest
+import job
+
+@pytest.fixture
+def leasable(manager, newJob):
+    obj = newJob("a")
+    with open(obj.originalFilePath, "wb") as f:
+        f.write(b"source")
+
+    manager.recoverStateFromDatabase()
+    return obj
+
+def lease(client, workerKey, worker: str = "w1"):
+    return client.post("/worker/lease", headers={"X-API-Key": workerKey}, json={"worker": worker})
+
+def upload(client, workerKey, leaseId: str, data: bytes, start: int, total: int):
+    return client.put("/worker/output", headers={
+        "X-API-Key": workerKey,
+        "Content-Range": f"bytes {start}-{start + len(data) - 1}/{total}"
+    }, query_string={"lease": leaseId}, data=data)
+
+def heartbeat(client, workerKey, leaseId: str, progress: dict | None = None):
+    return client.post("/worker/heartbeat", headers={"X-API-Key": workerKey}, json={"leaseId": leaseId, "progress": progress})
+
+def getState(client, apiKey, uuid: str):
+    return client.get("/job", headers={"X-API-Key": apiKey}, query_string={"id": uuid}).json["state"]
+
+
+def test_workerRoutesRejectClientKeys(client, apiKey, leasable):
+    assert lease(client, apiKey).status_code == 403
+    assert client.post("/worker/lease", json={"worker": "w1"}).status_code == 403
+    assert client.get("/worker/input", headers={"X-API-Key": apiKey}, query_string={"lease": "x"}).status_code == 403
+
+def test_claimAndHeartbeat(client, apiKey, workerKey, manager, leasable):
+    response = lease(client, workerKey)
+    assert response.status_code == 200
+    assert response.json["job"]["uuid"] == "a"
+    leaseId = response.json["leaseId"]
+
+    # The only job is taken
+    assert lease(client, workerKey, "w2").status_code == 204
+
+    input = client.get("/worker/input", headers={"X-API-Key": workerKey}, query_string={"lease": leaseId})
+    assert input.data == b"source"
+    assert input.mimetype == "video/mp4"
+
+    manager.getLease(leaseId).expiresAt = time.monotonic() + 1
+    assert heartbeat(client, workerKey, leaseId, {"out_time_us": "2500000"}).status_code == 200
+    assert manager.getLease(leaseId).expiresAt > time.monotonic() + job.LEASE_SECONDS - 5
+
+    assert client.get("/job", headers={"X-API-Key": apiKey}, query_string={"id": "a"}).json["progress"] == 2.5
+
+def test_expiredLeaseIsRequeued(client, workerKey, manager, leasable):
+    leaseId = lease(client, workerKey).json["leaseId"]
+    assert upload(client, workerKey, leaseId, b"abcd", 0, 8).json == {"received": 4}
+
+    expired = manager.getLease(leaseId)
+    partPath = expired.outputPartPath()
+    expired.expiresAt = time.monotonic() - 1
+    manager.reapLeases()
+
+    assert not os.path.exists(partPath)
+    assert heartbeat(client, workerKey, leaseId).status_code == 410
+    assert upload(client, workerKey, leaseId, b"efgh", 4, 8).status_code == 410
+
+    # Leased again, the new worker starts from an empty upload
+    response = lease(client, workerKey, "w2")
+    assert response.status_code == 200
+    assert response.json["leaseId"] != leaseId
+    received = client.get("/worker/output", headers={"X-API-Key": workerKey}, query_string={"lease": response.json["leaseId"]})
+    assert received.json == {"received": 0}
+
+def test_completeRequiresWholeOutput(client, apiKey, workerKey, leasable):
+    leaseId = lease(client, workerKey).json["leaseId"]
+    upload(client, workerKey, leaseId, b"abcd", 0, 8)
+
+    complete = {"leaseId": leaseId, "sizeBytes": 8, "startTimestamp": 1000, "endTimestamp": 1010}
+    response = client.post("/worker/complete", headers={"X-API-Key": workerKey}, json=complete)
+    assert response.status_code == 409
+    assert response.json["received"] == 4
+
+    upload(client, workerKey, leaseId, b"efgh", 4, 8)
+    response = client.post("/worker/complete", headers={"X-API-Key": workerKey}, json=complete)
+    assert response.status_code == 200
+    assert response.json["state"] == "COMPLETED"
+
+    with open(leasable.destinationFilePath, "rb") as f:
+        assert f.read() == b"abcdefgh"
+    assert getState(client, apiKey, "a") == "COMPLETED"
+    assert heartbeat(client, workerKey, leaseId).status_code == 410
+
+def test_failReleasesLease(client, apiKey, workerKey, leasable):
+    leaseId = lease(client, workerKey).json["leaseId"]
+
+    response = client.post("/worker/fail", headers={"X-API-Key": workerKey}, json={"leaseId": leaseId, "error": "ffmpeg exited with 1"})
+    assert response.status_code == 200
+    assert getState(client, apiKey, "a") == "FAILED"
+
+    assert heartbeat(client, workerKey, leaseId).status_code == 410
+    assert client.post("/worker/fail", headers={"X-API-Key": workerKey}, json={"leaseId": leaseId}).status_code == 410
+
+def test_cancelLeasedJob(client, apiKey, workerKey, leasable):
+    leaseId = lease(client, workerKey).json["leaseId"]
+
+    response = client.delete("/job", headers={"X-API-Key": apiKey}, query_string={"id": "a"})
+    assert response.status_code == 200
+    assert response.json["state"] == "CANCELLED"
+
+    # The worker learns about it on its next heartbeat
+    assert heartbeat(client, workerKey, leaseId).status_code == 410